@@ -0,0 +1,24 @@
+"""Version counters for invalidating groups of cache entries at once.
+
+Entries are stored under keys that embed the current version of their group;
+bumping the version orphans them all, and they expire on their own timeout.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted version key never resurrects stale entries
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_version(key)
@@ -0,0 +1,42 @@
+"""Reading the CSV and JSONL files behind the bulk import endpoints and commands."""
+import csv
+import io
+import json
+
+FORMATS = ('csv', 'jsonl')
+TRUE_VALUES = {'1', 'true', 'yes'}
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict) from a CSV or JSONL text stream.
+
+    A JSONL line that does not parse yields {'_error': message} so that the
+    importer can report it against its line and carry on.
+    """
+    if fmt == 'csv':
+        yield from enumerate(csv.DictReader(stream), start=2)
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError as exc:
+                    yield line, {'_error': f'Invalid JSON: {exc}'}
+    else:
+        raise ValueError(f'Unsupported format {fmt!r}')
+
+
+def open_upload(request):
+    """Return (text stream, format) for the "file" of a multipart import request.
+
+    The format comes from the "format" field or else the file extension.
+    Raises ValueError with a message for the client when there is no file or
+    its format is not supported.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        raise ValueError('file is required')
+    fmt = request.data.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+    if fmt not in FORMATS:
+        raise ValueError('format must be csv or jsonl')
+    return io.TextIOWrapper(upload.file, encoding='utf-8', newline=''), fmt
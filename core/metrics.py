@@ -0,0 +1,211 @@
+"""Per-route request metrics exposed in the Prometheus text format.
+
+Counters live in process memory, so each worker process serves its own series
+and Prometheus aggregates them across scrape targets.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger('core.metrics.slow')
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+# Statements kept per request for the slow-request log
+MAX_LOGGED_QUERIES = 100
+
+
+class RouteStats:
+    __slots__ = ('buckets', 'requests', 'seconds', 'queries', 'query_seconds', 'response_bytes')
+
+    def __init__(self, bucket_count):
+        self.buckets = [0] * bucket_count
+        self.requests = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.response_bytes = 0
+
+
+class Registry:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route, method, seconds, queries, query_seconds):
+        with self.lock:
+            stats = self.routes.get((route, method))
+            if stats is None:
+                stats = self.routes[(route, method)] = RouteStats(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+                    break
+            stats.requests += 1
+            stats.seconds += seconds
+            stats.queries += queries
+            stats.query_seconds += query_seconds
+
+    def add_bytes(self, route, method, size):
+        with self.lock:
+            stats = self.routes.get((route, method))
+            if stats is not None:
+                stats.response_bytes += size
+
+    def render(self):
+        with self.lock:
+            routes = sorted(
+                (key, (list(s.buckets), s.requests, s.seconds, s.queries, s.query_seconds, s.response_bytes))
+                for key, s in self.routes.items()
+            )
+
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by route and method.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (route, method), (buckets, requests, seconds, *_) in routes:
+            labels = f'route="{_escape(route)}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {requests}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {seconds}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {requests}')
+
+        counters = (
+            ('http_request_db_queries_total', 'SQL statements executed while serving the route.', 3),
+            ('http_request_db_query_seconds_total', 'Time spent in SQL statements.', 4),
+            ('http_response_size_bytes_total', 'Response body bytes sent.', 5),
+        )
+        for name, help_text, index in counters:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (route, method), values in routes:
+                lines.append(f'{name}{{route="{_escape(route)}",method="{method}"}} {values[index]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry(getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_LATENCY_BUCKETS))
+
+
+class QueryRecorder:
+    """Connection execute wrapper that counts and times every SQL statement."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if len(self.statements) < MAX_LOGGED_QUERIES:
+                self.statements.append((elapsed, sql))
+
+
+class MetricsMiddleware:
+    """Record latency, SQL work and response size per resolved route name and method.
+
+    Runs natively in both sync and async stacks, so ASGI requests keep their
+    async views instead of being adapted onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 0.5)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with self.recording(recorder):
+            response = self.get_response(request)
+        return self.observe(request, response, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with self.recording(recorder):
+            response = await self.get_response(request)
+        return self.observe(request, response, recorder, time.perf_counter() - start)
+
+    @staticmethod
+    def recording(recorder):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        return stack
+
+    def observe(self, request, response, recorder, elapsed):
+        match = request.resolver_match
+        route = (match.view_name or match.route) if match else 'unresolved'
+        method = request.method if request.method in METHODS else 'OTHER'
+        registry.observe(route, method, elapsed, recorder.count, recorder.seconds)
+        if not response.streaming:
+            registry.add_bytes(route, method, len(response.content))
+        elif response.is_async:
+            response.streaming_content = self._count_bytes_async(response.streaming_content, route, method)
+        else:
+            response.streaming_content = self._count_bytes(response.streaming_content, route, method)
+
+        if elapsed >= self.slow_seconds:
+            logger.warning(
+                'Slow request %s %s (%s) took %.3fs with %d queries (%.3fs in SQL):\n%s',
+                method, request.path, route, elapsed, recorder.count, recorder.seconds,
+                '\n'.join(f'  [{seconds * 1000:.1f}ms] {sql}' for seconds, sql in recorder.statements),
+            )
+        return response
+
+    @staticmethod
+    def _count_bytes(content, route, method):
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            registry.add_bytes(route, method, size)
+
+    @staticmethod
+    async def _count_bytes_async(content, route, method):
+        size = 0
+        try:
+            async for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            registry.add_bytes(route, method, size)
+
+
+def metrics_view(request):
+    """Served to scrapers from METRICS_ALLOWED_IPS and to logged-in staff; per-route traffic is not public."""
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
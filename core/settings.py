@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -45,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,8 +84,60 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts so concurrent writers queue
+            # for up to `timeout` seconds instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            # WAL lets readers proceed while a writer holds the lock
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+        },
+        # Seconds to keep a connection open between requests; 0 closes it after each request
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+    }
+}
+
+# Read replica for catalog reads. Locally, point DATABASE_REPLICA_PATH at a second
+# SQLite file and refresh it with `manage.py sync_sqlite_replicas`.
+if os.environ.get('DATABASE_REPLICA_PATH'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['DATABASE_REPLICA_PATH'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# How long a client that wrote keeps reading from the primary
+DATABASE_REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+# A shared cache makes the catalog cache and the auth throttles hold across
+# processes; set REDIS_URL in every deployment that runs more than one worker
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+# Cache alias holding the auth throttle buckets; only a RedisCache updates them
+# atomically across processes (see users.throttling)
+AUTH_THROTTLE_CACHE = 'default'
+
+# Seconds a cached catalog response stays valid; writes invalidate it earlier
+CATALOG_CACHE_TIMEOUT = 300
+
+
+# Product search engine, see shop.search.SearchBackend
+SHOP_SEARCH_BACKEND = 'shop.search.SQLiteFTSBackend'
 
 
 # Password validation
@@ -128,17 +183,59 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Token buckets of the password-hashing views (users.throttling), per client IP
+    # and per username: "<capacity>/<period>", refilled evenly over the period
+    'DEFAULT_THROTTLE_RATES': {
+        'token_ip': '20/min',
+        'token_username': '5/min',
+        'register_ip': '5/min',
+        'register_username': '3/min',
+        'change_password_ip': '10/min',
+        'change_password_username': '5/min',
+    },
 }
 
+# Read list serializers through shop.serializers.CompiledRepresentation
+SHOP_FAST_SERIALIZERS = True
+
+# Idempotency-Key handling (shop.idempotency): how long responses are replayed,
+# how long a retry waits for the request still holding its key, and how long
+# an unanswered claim is held before it is taken to belong to a dead worker.
+# The lease must stay well above the slowest request, including the database
+# busy timeout, or a late retry runs the view a second time.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT_SECONDS = 10
+IDEMPOTENCY_LEASE_SECONDS = 5 * 60
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Product image derivatives (shop.images)
+PRODUCT_IMAGE_WIDTHS = (200, 400, 800)
+PRODUCT_IMAGE_WORKERS = 2
+# Generate derivatives in the request thread instead of the worker pool
+PRODUCT_IMAGE_SYNC = False
+
+# Seconds an authenticated user stays cached; saves invalidate it earlier
+USER_AUTH_CACHE_TIMEOUT = 60
+
+# Request metrics (core.metrics), served at /metrics
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Requests slower than this log their SQL statements
+METRICS_SLOW_REQUEST_SECONDS = 0.5
+# Client addresses allowed to scrape /metrics without a staff login
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
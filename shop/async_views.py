@@ -0,0 +1,122 @@
+"""Read-only catalog endpoints served natively on ASGI.
+
+Queries go through Django's async ORM. DRF serializers are synchronous and may
+touch the database, so they run in a worker thread via sync_to_async, as does
+parsing the FacetFilter parameters (``within`` looks up its category).
+"""
+import base64
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .facets import FacetFilter
+from .models import Category, Product
+from .serializers import CategoryIndex, ProductSerializer, build_category_tree
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def _encode_cursor(product):
+    raw = f'{product.created_at.isoformat()}|{product.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(pk)
+
+
+_facet_filter = sync_to_async(FacetFilter)
+
+
+@sync_to_async
+def _serialize_products(products, request, many):
+    serializer = ProductSerializer(products, many=many, context={
+        'request': request, 'category_index': CategoryIndex()
+    })
+    return serializer.data
+
+
+@require_GET
+async def product_list(request):
+    try:
+        page_size = min(int(request.GET.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise ValueError
+        cursor = request.GET.get('cursor')
+        position = _decode_cursor(cursor) if cursor else None
+    except (TypeError, ValueError):
+        return _json({'detail': 'Invalid cursor or page_size.'}, status=400)
+    try:
+        facet_filter = await _facet_filter(request.GET)
+    except ValidationError as exc:
+        return _json(exc.detail, status=400)
+
+    # Same (-created_at, id) keyset as ProductCursorPagination
+    queryset = Product.objects.select_related('category').order_by('-created_at', 'id')
+    if position is not None:
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__gt=pk))
+    # The same filters as the synchronous product list
+    queryset = facet_filter.filter_queryset(queryset)
+
+    products = [product async for product in queryset[:page_size + 1].aiterator()]
+    next_url = None
+    if len(products) > page_size:
+        products = products[:page_size]
+        query = request.GET.copy()
+        query['cursor'] = _encode_cursor(products[-1])
+        next_url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+    results = await _serialize_products(products, request, True)
+    return _json({'next': next_url, 'results': results})
+
+
+@require_GET
+async def product_detail(request, pk):
+    try:
+        product = await Product.objects.select_related('category').aget(pk=pk)
+    except Product.DoesNotExist:
+        return _json({'detail': 'Not found.'}, status=404)
+    return _json(await _serialize_products(product, request, False))
+
+
+@require_GET
+async def category_tree(request):
+    queryset = Category.objects.order_by('depth', '-created_at')
+    root = request.GET.get('root')
+    depth = request.GET.get('depth')
+
+    base_depth = 0
+    if root is not None:
+        try:
+            root = int(root)
+        except ValueError:
+            return _json({'error': 'root must be an integer'}, status=400)
+        try:
+            root_category = await Category.objects.aget(pk=root)
+        except Category.DoesNotExist:
+            return _json({'detail': 'Not found.'}, status=404)
+        queryset = queryset.filter(root_category.subtree_q())
+        base_depth = root_category.depth
+    if depth is not None:
+        try:
+            depth = int(depth)
+            if depth < 0:
+                raise ValueError
+        except ValueError:
+            return _json({'error': 'depth must be a non-negative integer'}, status=400)
+        queryset = queryset.filter(depth__lte=base_depth + depth)
+
+    rows = [row async for row in queryset.values('id', 'name', 'slug', 'parent', 'depth').aiterator()]
+    return _json(build_category_tree(rows))
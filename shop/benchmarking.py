@@ -0,0 +1,188 @@
+"""Helpers shared by the benchmark management commands."""
+import logging
+import os
+import random
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test.utils import setup_databases, teardown_databases, setup_test_environment, teardown_test_environment
+
+from users.models import Address, UserProfile
+
+from .cache import bump_catalog_version
+from .models import (
+    Cart, CartItem, Category, Order, OrderItem, Product, ProductFacetCount, record_order_sales, record_order_status
+)
+from .search import get_search_backend
+
+WORDS = (
+    'alpine amber arctic atlas aurora basalt bamboo beacon birch blossom bolt breeze bronze canyon cedar '
+    'chrome cinder citrus classic cobalt comet copper coral cosmic crimson crystal cypress delta desert '
+    'drift dune eclipse ember emerald falcon fern flint forest fossil frost galaxy garnet glacier granite '
+    'harbor hazel horizon indigo iris ivory jade jasper juniper lagoon lava legend linen lotus lunar '
+    'maple marble meadow mesa midnight mint mirage monsoon moss nebula noble nova oak oasis obsidian ocean '
+    'olive onyx orbit orchid pacific pearl pebble pine plasma polar prairie prism quartz radiant rapid '
+    'raven reef ridge river ruby rustic saffron sage sapphire savanna scarlet sequoia shadow sierra silk '
+    'silver slate solar sparrow spruce steel stellar stone storm summit sunset tempest thunder tidal '
+    'timber titan topaz tundra twilight valley velvet vertex violet vista walnut willow wind zenith zephyr'
+).split()
+NOUNS = (
+    'backpack blender boots camera chair charger desk drone headphones jacket kettle keyboard lamp '
+    'laptop mattress monitor mouse mug notebook pan phone pillow printer router scarf sneakers speaker '
+    'tablet tent toaster umbrella vacuum wallet watch'
+).split()
+
+
+@contextmanager
+def benchmark_database(verbosity=0, on_disk=False):
+    """Run the body against freshly migrated test databases that are destroyed afterwards.
+
+    SQLite test databases live in shared memory, where concurrent writers fail
+    with "database table is locked" instead of waiting; pass on_disk=True to put
+    them in a temporary file when the body writes from several threads.
+    """
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory, ExitStack() as restore:
+        if on_disk:
+            for alias in connections:
+                test_settings = connections[alias].settings_dict['TEST']
+                if connections[alias].vendor == 'sqlite' and not test_settings.get('MIRROR'):
+                    restore.callback(test_settings.__setitem__, 'NAME', test_settings.get('NAME'))
+                    test_settings['NAME'] = os.path.join(directory, f'{alias}.sqlite3')
+        # Requests under benchmark load routinely cross the slow threshold; their SQL dumps would bury the report
+        slow_log = logging.getLogger('core.metrics.slow')
+        restore.callback(slow_log.setLevel, slow_log.level)
+        slow_log.setLevel(logging.ERROR)
+        old_config = setup_databases(verbosity, interactive=False)
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity)
+            teardown_test_environment()
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(max(samples, default=0) * 1000, 3),
+    }
+
+
+def seed_categories(roots=5, fanout=3, depth=3, prefix='bench'):
+    """Create a deterministic category tree and return all its nodes."""
+    created = []
+    level = [None]
+    for current_depth in range(depth):
+        next_level = []
+        for parent in level:
+            for i in range(roots if parent is None else fanout):
+                slug = f'{prefix}-{parent.pk if parent else "root"}-{i}'
+                category = Category.objects.create(name=slug.title(), slug=slug, parent=parent)
+                next_level.append(category)
+        created.extend(next_level)
+        level = next_level
+    return created
+
+
+def seed_products(count, categories, seed=0, batch_size=5000, prefix='bench', log=None):
+    """Bulk insert count deterministic products spread over categories, then reindex."""
+    rng = random.Random(seed)
+    category_ids = [category.pk for category in categories]
+    started = time.perf_counter()
+    for start in range(0, count, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, count)):
+            name = f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {rng.choice(NOUNS).title()}'
+            batch.append(Product(
+                category_id=rng.choice(category_ids),
+                name=name,
+                slug=f'{prefix}-{i}',
+                description=' '.join(rng.choice(WORDS) for _ in range(12)),
+                price=f'{rng.randint(100, 99999) / 100:.2f}',
+                stock=rng.randint(0, 50),
+                is_available=rng.random() > 0.1,
+            ))
+        Product.objects.bulk_create(batch)
+        if log:
+            log(f'  {min(start + batch_size, count)}/{count} products ({time.perf_counter() - started:.1f}s)')
+
+    # bulk_create skips the signals that normally keep these up to date
+    get_search_backend().rebuild(Product.objects.all())
+    ProductFacetCount.refresh()
+    bump_catalog_version()
+
+
+def seed_shoppers(count, cart_items=50, orders=20, order_lines=5, seed=0, prefix='bench', batch_size=5000, log=None):
+    """Create count users, each with a default address, an active cart and an order history.
+
+    Every user's password is "<prefix>-password". Lines are drawn from a fixed
+    pool of available products so that checkout-heavy scenarios stay repeatable.
+    """
+    rng = random.Random(seed)
+    pool = list(Product.objects.filter(is_available=True).order_by('pk').values_list('pk', 'price')[:10000])
+    password = make_password(f'{prefix}-password')
+
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}-user-{i}', email=f'{prefix}-user-{i}@example.com', password=password)
+        for i in range(count)
+    ], batch_size=batch_size)
+    # bulk_create skips the receiver that creates profiles
+    UserProfile.objects.bulk_create([UserProfile(user=user) for user in users], batch_size=batch_size)
+    addresses = Address.objects.bulk_create([
+        Address(
+            user=user, street_address=f'{i} {rng.choice(WORDS).title()} Street', city='Springfield',
+            state='State', country='Country', postal_code=f'{10000 + i}', is_default=True,
+        )
+        for i, user in enumerate(users)
+    ], batch_size=batch_size)
+
+    carts = Cart.objects.bulk_create([Cart(user=user) for user in users], batch_size=batch_size)
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product_id=pk, quantity=rng.randint(1, 5))
+        for cart in carts for pk, _ in rng.sample(pool, min(cart_items, len(pool)))
+    ], batch_size=batch_size)
+    Cart.objects.filter(pk__in=[cart.pk for cart in carts]).update(**Cart.line_totals())
+    if log:
+        log(f'  {count} users with {cart_items}-line carts')
+
+    statuses = [status for status, _ in Order.STATUS_CHOICES]
+    shoppers = list(zip(users, addresses))
+    users_per_batch = max(batch_size // max(orders, 1), 1)
+    for start in range(0, count, users_per_batch):
+        placed, lines = [], []
+        for user, address in shoppers[start:start + users_per_batch]:
+            for _ in range(orders):
+                picked = [(pk, price, rng.randint(1, 3)) for pk, price in rng.sample(pool, min(order_lines, len(pool)))]
+                placed.append(Order(
+                    user=user, status=rng.choice(statuses), shipping_address=address,
+                    total_amount=sum(price * quantity for _, price, quantity in picked),
+                ))
+                lines.append(picked)
+        Order.objects.bulk_create(placed)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=pk, price=price, quantity=quantity)
+            for order, picked in zip(placed, lines) for pk, price, quantity in picked
+        ], batch_size=batch_size)
+        # Rollups are normally maintained by checkout
+        placed = Order.objects.filter(pk__in=[order.pk for order in placed])
+        record_order_status(placed)
+        record_order_sales(placed.exclude(status='cancelled'))
+        if log:
+            log(f'  orders for {min(start + users_per_batch, count)}/{count} users')
+    return users
@@ -0,0 +1,105 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from core.cache import bump_version, get_version
+
+VERSION_KEY = 'shop:catalog:version'
+STATS_KEYS = {'hits': 'shop:catalog:stats:hits', 'misses': 'shop:catalog:stats:misses'}
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def get_catalog_version():
+    return get_version(VERSION_KEY)
+
+
+def bump_catalog_version():
+    bump_version(VERSION_KEY)
+
+
+def _record(stat):
+    key = STATS_KEYS[stat]
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_cache_stats():
+    return {stat: cache.get(key, 0) for stat, key in STATS_KEYS.items()}
+
+
+def reset_cache_stats():
+    cache.delete_many(list(STATS_KEYS.values()))
+
+
+def get_or_build(key, build, timeout=None):
+    """Read-through cache lookup where only one caller rebuilds a missing entry.
+
+    build() may return None to signal that the result must not be cached.
+    Returns a (value, hit) tuple.
+    """
+    value = cache.get(key)
+    if value is not None:
+        _record('hits')
+        return value, True
+    _record('misses')
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            value = build()
+            if value is not None:
+                cache.set(key, value, _timeout() if timeout is None else timeout)
+        finally:
+            cache.delete(lock_key)
+        return value, False
+
+    # Another request is rebuilding this entry: wait for it rather than stampeding the database
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value, True
+        if cache.get(lock_key) is None:
+            break
+    return build(), False
+
+
+def catalog_cache_key(request):
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'shop:catalog:v{get_catalog_version()}:{digest}'
+
+
+def cached_catalog_response(view_method):
+    """Cache the data of successful GET responses under the current catalog version."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return view_method(self, request, *args, **kwargs)
+
+        uncached = {}
+
+        def build():
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                uncached['response'] = response
+                return None
+            return response.data
+
+        data, hit = get_or_build(catalog_cache_key(request), build)
+        if data is None:
+            return uncached['response']
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+    return wrapper
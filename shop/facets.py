@@ -0,0 +1,124 @@
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from .models import Category, ProductFacetCount, PRICE_BUCKET_BOUNDS
+
+BOOLEAN_VALUES = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def price_bucket_label(bucket):
+    lower = PRICE_BUCKET_BOUNDS[bucket - 1] if bucket else 0
+    if bucket == len(PRICE_BUCKET_BOUNDS):
+        return f'{lower}+'
+    return f'{lower}-{PRICE_BUCKET_BOUNDS[bucket]}'
+
+
+PRICE_BUCKETS = {price_bucket_label(i): i for i in range(len(PRICE_BUCKET_BOUNDS) + 1)}
+
+
+class FacetFilter:
+    """Product filters and their facet counts, parsed from query parameters.
+
+    Supported parameters:
+        within        category slug; matches the category and all its descendants
+        category      category slug; matches that category only
+        price         comma separated bucket labels such as ``10-25,500+``
+        is_available  true/false
+        in_stock      true/false
+    """
+
+    def __init__(self, params):
+        self.category_slug = params.get('category')
+        self.within = None
+        if params.get('within'):
+            self.within = Category.objects.filter(slug=params['within']).first()
+            if self.within is None:
+                raise ValidationError({'within': 'Unknown category.'})
+
+        self.price_buckets = set()
+        for label in filter(None, params.get('price', '').split(',')):
+            if label not in PRICE_BUCKETS:
+                raise ValidationError({'price': f'Unknown price range {label!r}; use one of {list(PRICE_BUCKETS)}.'})
+            self.price_buckets.add(PRICE_BUCKETS[label])
+
+        self.is_available = self._parse_boolean(params, 'is_available')
+        self.in_stock = self._parse_boolean(params, 'in_stock')
+
+    @staticmethod
+    def _parse_boolean(params, name):
+        value = params.get(name)
+        if value is None:
+            return None
+        if value.lower() not in BOOLEAN_VALUES:
+            raise ValidationError({name: 'Must be true or false.'})
+        return BOOLEAN_VALUES[value.lower()]
+
+    def filter_queryset(self, queryset):
+        if self.category_slug is not None:
+            queryset = queryset.filter(category__slug=self.category_slug)
+        if self.within is not None:
+            queryset = queryset.filter(self.within.subtree_q(prefix='category__'))
+        if self.price_buckets:
+            price_q = Q()
+            for bucket in self.price_buckets:
+                bounds = {}
+                if bucket:
+                    bounds['price__gte'] = PRICE_BUCKET_BOUNDS[bucket - 1]
+                if bucket < len(PRICE_BUCKET_BOUNDS):
+                    bounds['price__lt'] = PRICE_BUCKET_BOUNDS[bucket]
+                price_q |= Q(**bounds)
+            queryset = queryset.filter(price_q)
+        if self.is_available is not None:
+            queryset = queryset.filter(is_available=self.is_available)
+        if self.in_stock is not None:
+            queryset = queryset.filter(stock__gt=0) if self.in_stock else queryset.filter(stock=0)
+        return queryset
+
+    def _matches(self, row, skip):
+        _, bucket, is_available, in_stock, _ = row
+        if skip != 'price' and self.price_buckets and bucket not in self.price_buckets:
+            return False
+        if skip != 'is_available' and self.is_available is not None and is_available != self.is_available:
+            return False
+        if skip != 'in_stock' and self.in_stock is not None and in_stock != self.in_stock:
+            return False
+        return True
+
+    def counts(self):
+        """Facet counts read from the rollup; each facet ignores its own filter."""
+        rows = ProductFacetCount.objects.filter(count__gt=0)
+        if self.category_slug is not None:
+            rows = rows.filter(category__slug=self.category_slug)
+        if self.within is not None:
+            rows = rows.filter(self.within.subtree_q(prefix='category__'))
+        rows = list(rows.values_list('category__path', 'price_bucket', 'is_available', 'in_stock', 'count'))
+
+        price, availability, stock, children = {}, {}, {}, {}
+        level = self.within.depth + 1 if self.within is not None else 0
+        total = 0
+        for row in rows:
+            path, bucket, is_available, in_stock, count = row
+            if self._matches(row, None):
+                total += count
+                # Attribute the row to the child of the current category that contains it
+                ancestors = path.split('/')[:-1]
+                if len(ancestors) > level:
+                    child_id = int(ancestors[level])
+                    children[child_id] = children.get(child_id, 0) + count
+            if self._matches(row, 'price'):
+                price[bucket] = price.get(bucket, 0) + count
+            if self._matches(row, 'is_available'):
+                availability[is_available] = availability.get(is_available, 0) + count
+            if self._matches(row, 'in_stock'):
+                stock[in_stock] = stock.get(in_stock, 0) + count
+
+        categories = Category.objects.filter(pk__in=children).order_by('name').values('id', 'slug', 'name')
+        return {
+            'total': total,
+            'category': [{**category, 'count': children[category['id']]} for category in categories],
+            'price': [
+                {'value': label, 'count': price.get(bucket, 0)} for label, bucket in PRICE_BUCKETS.items()
+            ],
+            'is_available': [{'value': value, 'count': availability.get(value, 0)} for value in (True, False)],
+            'in_stock': [{'value': value, 'count': stock.get(value, 0)} for value in (True, False)],
+        }
@@ -0,0 +1,86 @@
+"""Set-based order status transitions for warehouse batches."""
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Order, OrderItem, Product, ProductFacetCount, price_bucket, record_status_change
+
+# Statuses each status may move to; delivered and cancelled orders are final
+ALLOWED_TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+
+
+def transition_orders(order_ids, new_status):
+    """Move the given orders to new_status in one transaction.
+
+    Orders are updated with one UPDATE per current status. Orders whose
+    transition is not allowed are left alone and reported. Cancelled orders
+    have their units put back into stock in a single UPDATE. Returns one
+    {'id', 'result', ...} dict per requested id, in request order.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    results = {}
+    with transaction.atomic():
+        current = dict(
+            Order.objects.select_for_update().filter(pk__in=order_ids).order_by().values_list('pk', 'status')
+        )
+        by_status = {}
+        for pk in order_ids:
+            old_status = current.get(pk)
+            if old_status is None:
+                results[pk] = {'id': pk, 'result': 'error', 'error': 'Order not found'}
+            elif old_status == new_status:
+                results[pk] = {'id': pk, 'result': 'unchanged', 'status': old_status}
+            elif new_status not in ALLOWED_TRANSITIONS[old_status]:
+                results[pk] = {
+                    'id': pk, 'result': 'error', 'status': old_status,
+                    'error': f'Cannot move a {old_status} order to {new_status}',
+                }
+            else:
+                by_status.setdefault(old_status, []).append(pk)
+                results[pk] = {'id': pk, 'result': 'updated', 'from': old_status, 'status': new_status}
+
+        now = timezone.now()
+        for old_status, pks in by_status.items():
+            # Bulk updates skip Order.save(), so the rollups are moved here
+            orders = Order.objects.filter(pk__in=pks)
+            orders.update(status=new_status, updated_at=now)
+            record_status_change(orders, old_status, new_status)
+
+        if new_status == 'cancelled' and by_status:
+            restock([pk for pks in by_status.values() for pk in pks])
+    return [results[pk] for pk in order_ids]
+
+
+def restock(order_ids):
+    """Return the units of the given orders to Product.stock with one UPDATE."""
+    units = dict(
+        OrderItem.objects.filter(order__in=order_ids).order_by().values('product_id').annotate(
+            total=Sum('quantity')
+        ).values_list('product_id', 'total')
+    )
+    if not units:
+        return
+    # Products still at zero stock move back to the in-stock facet
+    back_in_stock = Counter(
+        (category_id, price_bucket(price), is_available)
+        for category_id, price, is_available in Product.objects.filter(pk__in=units, stock=0).values_list(
+            'category_id', 'price', 'is_available'
+        )
+    )
+    Product.objects.filter(pk__in=units).update(stock=F('stock') + Case(
+        *[When(pk=pk, then=Value(total)) for pk, total in units.items()],
+        output_field=models.PositiveIntegerField()
+    ))
+    for (category_id, bucket, is_available), count in back_in_stock.items():
+        ProductFacetCount.adjust((category_id, bucket, is_available, False), -count)
+        ProductFacetCount.adjust((category_id, bucket, is_available, True), count)
+    bump_catalog_version()
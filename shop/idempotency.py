@@ -0,0 +1,139 @@
+"""Idempotency-Key support for unsafe endpoints that clients retry.
+
+The first request with a given key claims it by inserting a row and runs the
+view; its response is stored for IDEMPOTENCY_KEY_TTL seconds and replayed to
+repeats with the same key, which never run the view again. A repeat that
+arrives while the first request is still running waits for its outcome.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def _wait_seconds():
+    return getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+
+
+def _lease_seconds():
+    return getattr(settings, 'IDEMPOTENCY_LEASE_SECONDS', 5 * 60)
+
+
+def _fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.get_full_path(), data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _stale_q(now):
+    # Expired keys, and claims left behind by a worker that died mid-request, are free again.
+    # A claim still within its lease may belong to a slow request, so it is never reclaimed.
+    return Q(expires_at__lte=now) | Q(
+        status_code__isnull=True, created_at__lte=now - timedelta(seconds=_lease_seconds())
+    )
+
+
+def _claim(user, key, fingerprint):
+    """Insert the claim row; None if another request holds the key."""
+    now = timezone.now()
+    IdempotencyKey.objects.filter(_stale_q(now), user=user, key=key).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint, created_at=now, expires_at=now + _ttl()
+            )
+    except IntegrityError:
+        return None
+
+
+def _replay(record):
+    return Response(record.response_data, status=record.status_code, headers={REPLAYED_HEADER: 'true'})
+
+
+def idempotent(view_method):
+    """Make a view method safe to retry when the client sends an Idempotency-Key header.
+
+    Server errors are not stored, so a retry after one runs the view again.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = _fingerprint(request)
+        deadline = time.monotonic() + _wait_seconds()
+        while True:
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).exclude(
+                _stale_q(timezone.now())
+            ).first()
+            if record is None:
+                claim = _claim(request.user, key, fingerprint)
+                if claim is not None:
+                    break
+                continue
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {"error": "Idempotency-Key was already used for a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.status_code is not None:
+                return _replay(record)
+            # The first request is still running: wait for its response instead of racing it
+            if time.monotonic() >= deadline:
+                return Response(
+                    {"error": "A request with this Idempotency-Key is still in progress"},
+                    status=status.HTTP_409_CONFLICT
+                )
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except BaseException:
+            claim.delete()
+            raise
+        if response.status_code >= 500:
+            claim.delete()
+        else:
+            IdempotencyKey.objects.filter(pk=claim.pk).update(
+                status_code=response.status_code, response_data=response.data
+            )
+        return response
+    return wrapper
+
+
+def purge_expired_keys(chunk_size=5000):
+    """Delete expired keys in batches of chunk_size; returns how many were removed."""
+    now = timezone.now()
+    removed = 0
+    while True:
+        pks = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return removed
+        removed += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
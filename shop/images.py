@@ -0,0 +1,123 @@
+"""Resized WebP/JPEG derivatives of product images, generated off the request path."""
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+_executor = None
+
+
+def variant_widths():
+    return getattr(settings, 'PRODUCT_IMAGE_WIDTHS', (200, 400, 800))
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2), thread_name_prefix='product-images'
+        )
+    return _executor
+
+
+def render_variants(source):
+    """Yield (format, width, bytes) for every derivative of an open image file."""
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        widths = [width for width in variant_widths() if width < image.width] or [image.width]
+        for width in widths:
+            height = max(round(image.height * width / image.width), 1)
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            for fmt, options in FORMATS.items():
+                frame = resized
+                if fmt == 'jpeg' and frame.mode != 'RGB':
+                    # JPEG has no alpha channel: flatten onto white
+                    background = Image.new('RGB', frame.size, 'white')
+                    background.paste(frame, mask=frame.convert('RGBA').getchannel('A'))
+                    frame = background
+                elif frame.mode not in ('RGB', 'RGBA'):
+                    frame = frame.convert('RGBA')
+                buffer = io.BytesIO()
+                frame.save(buffer, **options)
+                yield fmt, width, buffer.getvalue()
+
+
+def generate_variants(product):
+    """Write the derivatives of product.image and return the new {format: {width: name}} map."""
+    variants = {}
+    with product.image.open('rb') as source:
+        for fmt, width, data in render_variants(source):
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            # Content-hashed names never change meaning, so they can be cached forever
+            name = f'products/variants/{product.pk}/{width}w-{digest}.{fmt}'
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(data))
+            variants.setdefault(fmt, {})[str(width)] = name
+    return variants
+
+
+def process_product_image(product_id):
+    from .cache import bump_catalog_version
+    from .models import Product
+
+    try:
+        product = Product.objects.filter(pk=product_id).first()
+        if product is None or not product.image:
+            return None
+        variants = generate_variants(product)
+        Product.objects.filter(pk=product_id, image=product.image.name).update(image_variants=variants)
+        bump_catalog_version()
+
+        # Derivatives of earlier images; Product.save() already dropped them from image_variants
+        new_names = {name for widths in variants.values() for name in widths.values()}
+        directory = f'products/variants/{product.pk}'
+        if default_storage.exists(directory):
+            for filename in default_storage.listdir(directory)[1]:
+                if f'{directory}/{filename}' not in new_names:
+                    default_storage.delete(f'{directory}/{filename}')
+        return variants
+    except Exception:
+        logger.exception('Could not generate image variants for product %s', product_id)
+        raise
+
+
+def _process_in_worker(product_id):
+    # Worker threads own their database connections
+    close_old_connections()
+    try:
+        return process_product_image(product_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_product_image(product_id):
+    """Generate variants once the current transaction commits."""
+    if getattr(settings, 'PRODUCT_IMAGE_SYNC', False):
+        transaction.on_commit(lambda: process_product_image(product_id))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_process_in_worker, product_id))
+
+
+def srcset(variants, build_uri=None):
+    """Build {format: "url 200w, url 400w"} from a stored variant map."""
+    build_uri = build_uri or (lambda url: url)
+    return {
+        fmt: ', '.join(
+            f'{build_uri(default_storage.url(name))} {width}w'
+            for width, name in sorted(widths.items(), key=lambda item: int(item[0]))
+        )
+        for fmt, widths in variants.items()
+    }
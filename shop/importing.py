@@ -0,0 +1,131 @@
+"""Streaming bulk import and export of the product catalog."""
+import csv
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from core.importing import TRUE_VALUES
+from .cache import bump_catalog_version
+from .models import Cart, Category, Product, ProductFacetCount
+from .search import get_search_backend
+
+PRODUCT_FIELDS = ('name', 'description', 'price', 'stock', 'is_available')
+EXPORT_FIELDS = ('slug', 'category') + PRODUCT_FIELDS + ('image',)
+
+
+def _values(row, categories):
+    if '_error' in row:
+        raise ValueError(row['_error'])
+    slug = str(row.get('slug') or '').strip()
+    if not slug:
+        raise ValueError('slug is required')
+    category_slug = str(row.get('category') or '').strip()
+    if category_slug not in categories:
+        raise ValueError(f'unknown category {category_slug!r}')
+
+    values = {'slug': slug, 'category_id': categories[category_slug]}
+    for field in ('name', 'description', 'price'):
+        values[field] = str(row.get(field) or '').strip()
+    stock = row.get('stock')
+    values['stock'] = 0 if stock in (None, '') else stock
+    available = row.get('is_available')
+    values['is_available'] = True if available in (None, '') else (
+        available is True or str(available).lower() in TRUE_VALUES
+    )
+    return values
+
+
+def import_products(rows, chunk_size=1000):
+    """Create or update products by slug from (line, row) pairs, one transaction per chunk.
+
+    Categories are given by slug and resolved from a map loaded once. Bad rows
+    are reported and skipped; they never abort the import. Returns
+    {'created': int, 'updated': int, 'errors': [{'line': int, 'error': str}]}.
+    """
+    categories = dict(Category.objects.values_list('slug', 'pk'))
+    result = {'created': 0, 'updated': 0, 'errors': []}
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        parsed = {}
+        for line, row in chunk:
+            try:
+                values = _values(row, categories)
+                product = Product(**values)
+                product.clean_fields(exclude=['category', 'image', 'image_variants'])
+            except ValidationError as exc:
+                result['errors'].append({'line': line, 'error': '; '.join(
+                    f'{field}: {" ".join(messages)}' for field, messages in exc.message_dict.items()
+                )})
+                continue
+            except Exception as exc:
+                result['errors'].append({'line': line, 'error': str(exc)})
+                continue
+            if values['slug'] in parsed:
+                result['errors'].append({'line': line, 'error': f"duplicate slug {values['slug']!r}"})
+                continue
+            # Keep the converted values, e.g. price as a Decimal
+            parsed[values['slug']] = {field: getattr(product, field) for field in values}
+
+        with transaction.atomic():
+            existing = Product.objects.filter(slug__in=parsed).only(
+                'pk', 'slug', 'category_id', *PRODUCT_FIELDS
+            ).in_bulk(field_name='slug')
+            created, updated, repriced = [], [], []
+            touched_categories = set()
+            now = timezone.now()
+            for slug, values in parsed.items():
+                product = existing.get(slug)
+                touched_categories.add(values['category_id'])
+                if product is None:
+                    created.append(Product(**values))
+                    continue
+                touched_categories.add(product.category_id)
+                for field, value in values.items():
+                    setattr(product, field, value)
+                product.updated_at = now
+                if product.price != product._loaded_price:
+                    repriced.append(product.pk)
+                updated.append(product)
+
+            # Bulk writes skip Product.save(), so the derived data is brought up to date here
+            Product.objects.bulk_create(created)
+            Product.objects.bulk_update(updated, ['category_id', *PRODUCT_FIELDS, 'updated_at'])
+            get_search_backend().index(created + updated)
+            ProductFacetCount.refresh(touched_categories)
+            if repriced:
+                Cart.objects.filter(items__product__in=repriced).update(**Cart.line_totals())
+        result['created'] += len(created)
+        result['updated'] += len(updated)
+
+    if result['created'] or result['updated']:
+        bump_catalog_version()
+    return result
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_products(queryset, fmt, chunk_size=2000):
+    """Yield the catalog as CSV or JSONL text, holding at most one chunk of rows in memory."""
+    rows = queryset.order_by('pk').values_list(
+        'slug', 'category__slug', *PRODUCT_FIELDS, 'image'
+    ).iterator(chunk_size=chunk_size)
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    elif fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row)), default=str) + '\n'
+    else:
+        raise ValueError(f'Unsupported format {fmt!r}')
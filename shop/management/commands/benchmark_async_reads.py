@@ -0,0 +1,133 @@
+import asyncio
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+
+from shop.benchmarking import benchmark_database, seed_categories, seed_products, summarize
+from shop.models import Product
+
+HOST = 'testserver'
+
+
+def asgi_scope(path, query=''):
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', HOST.encode())], 'server': (HOST, 80), 'client': ('127.0.0.1', 50000),
+    }
+
+
+def wsgi_environ(path, query=''):
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST, 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(), 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent catalog read throughput of the async ASGI views and the WSGI DRF views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=20, help='Requests per concurrent client')
+        parser.add_argument('--with-cache', action='store_true', help='Keep the catalog response cache enabled')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_products(options['products'], seed_categories())
+            product_ids = list(Product.objects.values_list('pk', flat=True)[:100])
+            routes = {
+                'asgi': [
+                    ('/api/shop/async/products/', 'page_size=50'),
+                    ('/api/shop/async/categories/tree/', ''),
+                ] + [(f'/api/shop/async/products/{pk}/', '') for pk in product_ids[:10]],
+                'wsgi': [
+                    ('/api/shop/products/', 'page_size=50'),
+                    ('/api/shop/categories/tree/', ''),
+                ] + [(f'/api/shop/products/{pk}/', '') for pk in product_ids[:10]],
+            }
+            caches = None if options['with_cache'] else {
+                'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+            }
+            with override_settings(**({'CACHES': caches} if caches else {})):
+                report = {
+                    'asgi': self.run_asgi(routes['asgi'], options),
+                    'wsgi': self.run_wsgi(routes['wsgi'], options),
+                }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def run_asgi(self, routes, options):
+        application = get_asgi_application()
+        samples, failures = [], 0
+
+        async def request(path, query):
+            nonlocal failures
+            sent = {'body': False}
+            messages = []
+
+            async def receive():
+                if not sent['body']:
+                    sent['body'] = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # Never disconnect: the handler cancels this wait once the response is sent
+                await asyncio.Future()
+
+            async def send(message):
+                messages.append(message)
+
+            start = time.perf_counter()
+            await application(asgi_scope(path, query), receive, send)
+            samples.append(time.perf_counter() - start)
+            failures += messages[0]['status'] != 200
+
+        async def client(index):
+            for i in range(options['requests']):
+                await request(*routes[(index + i) % len(routes)])
+
+        async def main():
+            await asyncio.gather(*(client(i) for i in range(options['concurrency'])))
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        return self.result(samples, failures, time.perf_counter() - start)
+
+    def run_wsgi(self, routes, options):
+        application = get_wsgi_application()
+        samples, failures = [], []
+
+        def request(path, query):
+            statuses = []
+            start = time.perf_counter()
+            response = application(wsgi_environ(path, query), lambda status, headers: statuses.append(status))
+            b''.join(response)
+            response.close()
+            samples.append(time.perf_counter() - start)
+            if not statuses[0].startswith('200'):
+                failures.append(statuses[0])
+
+        def client(index):
+            for i in range(options['requests']):
+                request(*routes[(index + i) % len(routes)])
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(client, range(options['concurrency'])))
+        return self.result(samples, len(failures), time.perf_counter() - start)
+
+    @staticmethod
+    def result(samples, failures, elapsed):
+        return {
+            **summarize(samples),
+            'failures': failures,
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(len(samples) / elapsed, 1),
+        }
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+
+from shop.benchmarking import benchmark_database
+from shop.models import Category, Product, Cart, CartItem
+
+BENCH_SLUG = 'bench-cart-contention'
+
+
+class Command(BaseCommand):
+    help = 'Hammer a single cart from many threads and verify that no quantity update is lost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=25, help='Requests per thread')
+        parser.add_argument('--products', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=True):
+            user = User.objects.create_user(username=BENCH_SLUG)
+            category = Category.objects.create(name='Benchmark', slug=BENCH_SLUG)
+            products = [
+                Product.objects.create(
+                    category=category, name=f'Benchmark {i}', slug=f'{BENCH_SLUG}-{i}',
+                    description='', price='1.25', stock=0
+                )
+                for i in range(options['products'])
+            ]
+            cart = Cart.objects.create(user=user)
+            elapsed, requests, errors = self.run_threads(user, cart, products, options)
+            self.verify(cart, products, options['threads'] * options['requests'])
+
+        self.stdout.write(
+            f'{requests} requests from {options["threads"]} threads in {elapsed:.2f}s '
+            f'({requests / elapsed:.0f} req/s), {errors} errors'
+        )
+        if errors:
+            raise CommandError(f'{errors} requests failed')
+        self.stdout.write(self.style.SUCCESS('No lost updates'))
+
+    def run_threads(self, user, cart, products, options):
+        bulk_url = f'/api/shop/cart/{cart.pk}/bulk_update_items/'
+        add_url = f'/api/shop/cart/{cart.pk}/add_item/'
+        payload = {'items': [{'product_id': product.pk, 'delta': 1} for product in products]}
+        counters = {'requests': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(index):
+            client = APIClient()
+            client.force_authenticate(user)
+            # Half the threads sync the whole basket at once, the other half add line by line
+            try:
+                for _ in range(options['requests']):
+                    if index % 2:
+                        responses = [client.post(bulk_url, payload, format='json')]
+                    else:
+                        responses = [
+                            client.post(add_url, {'product_id': product.pk, 'quantity': 1}, format='json')
+                            for product in products
+                        ]
+                    with lock:
+                        counters['requests'] += len(responses)
+                        counters['errors'] += sum(response.status_code != 200 for response in responses)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, counters['requests'], counters['errors']
+
+    def verify(self, cart, products, expected):
+        quantities = dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+        wrong = {product.pk: quantities.get(product.pk) for product in products if quantities.get(product.pk) != expected}
+        if wrong:
+            raise CommandError(f'Lost updates, expected {expected} of each product, got {wrong}')
+        cart.refresh_from_db()
+        if cart.item_count != expected * len(products):
+            raise CommandError(f'Cart item_count {cart.item_count} != {expected * len(products)}')
@@ -0,0 +1,291 @@
+import json
+import time
+from itertools import count
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from shop.benchmarking import benchmark_database, seed_categories, seed_products, seed_shoppers, summarize
+from shop.models import Cart, CartItem, Order, Product
+from shop.urls import router
+from users.models import Address
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'endpoints.json'
+
+
+class Scenario:
+    """One request shape. path and data may be callables taking the fixture context."""
+
+    def __init__(self, route, method, path, data=None, user='shopper', status=200, prepare=None, repeat=None,
+                 fmt='json'):
+        self.route = route
+        self.method = method
+        self.path = path
+        self.data = data
+        self.user = user
+        self.status = status
+        self.prepare = prepare
+        self.repeat = repeat
+        self.fmt = fmt
+
+    @property
+    def name(self):
+        return f'{self.method} {self.route}'
+
+    def resolve(self, value, ctx):
+        return value(ctx) if callable(value) else value
+
+
+def refill_checkout_cart(ctx):
+    cart, _ = Cart.objects.get_or_create(user=ctx['buyer'], is_active=True)
+    CartItem.objects.bulk_create(
+        [CartItem(cart=cart, product_id=pk, quantity=1) for pk in ctx['checkout_products']], ignore_conflicts=True
+    )
+    Cart.objects.filter(pk=cart.pk).update(**Cart.line_totals())
+
+
+def reopen_batch(ctx):
+    # Rollups of the benchmark data are not read afterwards, so a plain reset is enough
+    Order.objects.filter(pk__in=ctx['batch_orders']).update(status='processing')
+
+
+def restore_line(ctx):
+    ctx['light_cart'].apply_item_changes({ctx['product'].pk: ('set', 1)})
+
+
+def import_csv(ctx):
+    rows = ''.join(
+        f'{p.slug},{p.category.slug},{p.name},{p.description},{p.price},{p.stock},true\n' for p in ctx['import_products']
+    )
+    header = 'slug,category,name,description,price,stock,is_available\n'
+    return {'file': SimpleUploadedFile('products.csv', (header + rows).encode())}
+
+
+def user_import_csv(ctx):
+    rows = ''.join(f'import-{next(ctx["sequence"])},x@example.com\n' for _ in range(20))
+    return {'file': SimpleUploadedFile('users.csv', ('username,email\n' + rows).encode())}
+
+
+SCENARIOS = [
+    Scenario('api-root', 'GET', '/api/shop/'),
+    Scenario('category-list', 'GET', '/api/shop/categories/'),
+    Scenario('category-list', 'POST', '/api/shop/categories/', status=201, data=lambda ctx: {
+        'name': 'Bench new', 'slug': f'bench-new-{next(ctx["sequence"])}', 'parent': ctx['leaf'].pk,
+    }),
+    Scenario('category-detail', 'GET', lambda ctx: f'/api/shop/categories/{ctx["leaf"].pk}/'),
+    Scenario('category-detail', 'PATCH', lambda ctx: f'/api/shop/categories/{ctx["leaf"].pk}/',
+             data={'description': 'benchmark'}),
+    Scenario('category-tree', 'GET', '/api/shop/categories/tree/'),
+    Scenario('category-subcategories', 'GET', lambda ctx: f'/api/shop/categories/{ctx["root"].pk}/subcategories/'),
+    Scenario('category-products', 'GET', lambda ctx: f'/api/shop/categories/{ctx["root"].pk}/products/'),
+    Scenario('product-list', 'GET', '/api/shop/products/?page_size=50'),
+    Scenario('product-list', 'GET', lambda ctx: f'/api/shop/products/?facets=true&within={ctx["root"].slug}'),
+    Scenario('product-detail', 'GET', lambda ctx: f'/api/shop/products/{ctx["product"].pk}/'),
+    Scenario('product-detail', 'PATCH', lambda ctx: f'/api/shop/products/{ctx["product"].pk}/',
+             data=lambda ctx: {'price': str(ctx['product'].price)}),
+    Scenario('product-search', 'GET', lambda ctx: f'/api/shop/products/search/?q={ctx["term"]}'),
+    Scenario('product-bulk-import', 'POST', '/api/shop/products/import/', user='admin', data=import_csv,
+             fmt='multipart'),
+    Scenario('product-export', 'GET', lambda ctx: f'/api/shop/products/export/?category={ctx["leaf"].slug}',
+             user='admin'),
+    Scenario('cart-list', 'GET', '/api/shop/cart/'),
+    Scenario('cart-detail', 'GET', lambda ctx: f'/api/shop/cart/{ctx["cart"].pk}/'),
+    Scenario('cart-add-item', 'POST', lambda ctx: f'/api/shop/cart/{ctx["light_cart"].pk}/add_item/',
+             user='light', data=lambda ctx: {'product_id': ctx['product'].pk, 'quantity': 1}),
+    Scenario('cart-bulk-update-items', 'POST', lambda ctx: f'/api/shop/cart/{ctx["cart"].pk}/bulk_update_items/',
+             data=lambda ctx: {'items': [{'product_id': pk, 'quantity': 2} for pk in ctx['cart_products'][:50]]}),
+    Scenario('cart-remove-item', 'POST', lambda ctx: f'/api/shop/cart/{ctx["light_cart"].pk}/remove_item/',
+             user='light', status=204, prepare=restore_line, data=lambda ctx: {'product_id': ctx['product'].pk}),
+    Scenario('order-list', 'GET', '/api/shop/orders/'),
+    Scenario('order-list', 'POST', '/api/shop/orders/', user='buyer', status=201, prepare=refill_checkout_cart,
+             data={}),
+    Scenario('order-detail', 'GET', lambda ctx: f'/api/shop/orders/{ctx["order"].pk}/'),
+    Scenario('order-bulk-status', 'POST', '/api/shop/orders/bulk-status/', user='admin', prepare=reopen_batch,
+             data=lambda ctx: {'order_ids': ctx['batch_orders'], 'status': 'shipped'}),
+    Scenario('report-revenue', 'GET', '/api/shop/reports/revenue/', user='admin'),
+    Scenario('report-top-sellers', 'GET', '/api/shop/reports/top_sellers/', user='admin'),
+    Scenario('report-order-status', 'GET', '/api/shop/reports/order_status/', user='admin'),
+    Scenario('async-product-list', 'GET', '/api/shop/async/products/'),
+    Scenario('async-product-detail', 'GET', lambda ctx: f'/api/shop/async/products/{ctx["product"].pk}/'),
+    Scenario('async-category-tree', 'GET', '/api/shop/async/categories/tree/'),
+    Scenario('token_obtain_pair', 'POST', '/api/token/', user=None, repeat=5, data=lambda ctx: {
+        'username': ctx['shopper'].username, 'password': 'bench-password',
+    }),
+    Scenario('token_refresh', 'POST', '/api/token/refresh/', user=None,
+             data=lambda ctx: {'refresh': str(RefreshToken.for_user(ctx['shopper']))}),
+    Scenario('register', 'POST', '/api/users/register/', user=None, status=201, repeat=5, data=lambda ctx: {
+        'username': f'bench-new-{next(ctx["sequence"])}', 'email': 'new@example.com', 'password': 'bench-password',
+    }),
+    Scenario('user-bulk-import', 'POST', '/api/users/bulk-import/', user='admin', data=user_import_csv,
+             fmt='multipart'),
+    Scenario('profile', 'GET', '/api/users/profile/'),
+    Scenario('change-password', 'PUT', '/api/users/change-password/', user='light', repeat=5, data={
+        'old_password': 'bench-password', 'new_password': 'bench-password',
+    }),
+    Scenario('address-list', 'GET', '/api/users/addresses/'),
+    Scenario('address-detail', 'GET', lambda ctx: f'/api/users/addresses/{ctx["address"].pk}/'),
+    Scenario('set-default-address', 'PATCH', lambda ctx: f'/api/users/addresses/{ctx["address"].pk}/set-default/'),
+    Scenario('metrics', 'GET', '/metrics', user=None),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive every API endpoint against a deterministic large dataset, record latency percentiles and query '
+        'counts, and fail when they regress against a JSON baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--category-depth', type=int, default=6)
+        parser.add_argument('--category-fanout', type=int, default=3)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--cart-items', type=int, default=200, help='Lines in every seeded cart')
+        parser.add_argument('--orders', type=int, default=200, help='Orders in every seeded user history')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per scenario')
+        parser.add_argument('--only', help='Comma-separated route names to run')
+        parser.add_argument('--with-cache', action='store_true', help='Keep the catalog response cache enabled')
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed p95 slowdown as a fraction of the baseline')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Ignore p95 slowdowns smaller than this many milliseconds')
+        parser.add_argument('--output', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        missing = {url.name for url in router.urls} - {scenario.route for scenario in SCENARIOS}
+        if missing:
+            raise CommandError(f'No benchmark scenario for routes: {", ".join(sorted(missing))}')
+
+        dataset = {key: options[key] for key in (
+            'products', 'category_depth', 'category_fanout', 'users', 'cart_items', 'orders', 'seed', 'with_cache',
+        )}
+        scenarios = SCENARIOS
+        if options['only']:
+            only = set(options['only'].split(','))
+            scenarios = [scenario for scenario in SCENARIOS if scenario.route in only]
+
+        overrides = {
+            # Every timed login comes from one client, which the auth throttles would stop
+            'REST_FRAMEWORK': {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}},
+        }
+        if not options['with_cache']:
+            overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with benchmark_database(), override_settings(**overrides):
+            ctx = self.seed(options)
+            results = {scenario.name: self.run(scenario, ctx, options['requests']) for scenario in scenarios}
+        report = {'dataset': dataset, 'endpoints': results}
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2) + '\n')
+        baseline_path = Path(options['baseline'])
+        if options['update_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(report, indent=2) + '\n')
+            self.stdout.write(json.dumps(report, indent=2))
+            self.stdout.write(self.style.SUCCESS(f'Wrote baseline to {baseline_path}'))
+            return
+
+        self.stdout.write(json.dumps(report, indent=2))
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f'No baseline at {baseline_path}; rerun with --update-baseline'))
+            return
+        baseline = json.loads(baseline_path.read_text())
+        if baseline['dataset'] != dataset:
+            raise CommandError(f'Baseline was recorded for a different dataset: {baseline["dataset"]}')
+        regressions = self.compare(baseline['endpoints'], results, options)
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(f'  {line}' for line in regressions))
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_path}'))
+
+    def seed(self, options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        categories = seed_categories(roots=4, fanout=options['category_fanout'], depth=options['category_depth'])
+        seed_products(options['products'], categories, seed=options['seed'], log=log)
+        users = seed_shoppers(
+            options['users'] + 2, cart_items=options['cart_items'], orders=options['orders'], seed=options['seed'],
+            log=log,
+        )
+        shopper, light, buyer = users[0], users[-2], users[-1]
+        # The light user starts with an empty cart, the buyer with no history to check out repeatedly
+        CartItem.objects.filter(cart__user__in=[light, buyer]).delete()
+        Cart.objects.filter(user__in=[light, buyer]).update(**Cart.line_totals())
+        admin = type(shopper).objects.create_superuser('bench-admin', 'admin@example.com', 'bench-password')
+
+        cart = Cart.objects.get(user=shopper, is_active=True)
+        checkout_products = list(
+            Product.objects.filter(is_available=True).order_by('pk').values_list('pk', flat=True)[:10]
+        )
+        # Enough stock for every checkout the run performs
+        Product.objects.filter(pk__in=checkout_products).update(stock=10 ** 6)
+        product = Product.objects.select_related('category').filter(is_available=True).order_by('pk').first()
+        return {
+            'tokens': {
+                name: str(RefreshToken.for_user(user).access_token)
+                for name, user in (('shopper', shopper), ('light', light), ('buyer', buyer), ('admin', admin))
+            },
+            'shopper': shopper,
+            'buyer': buyer,
+            'root': categories[0],
+            'leaf': categories[-1],
+            'product': product,
+            'term': product.name.split()[0].lower(),
+            'cart': cart,
+            'cart_products': list(cart.items.values_list('product_id', flat=True)),
+            'light_cart': Cart.objects.get(user=light, is_active=True),
+            'checkout_products': checkout_products,
+            'order': Order.objects.filter(user=shopper).order_by('pk').first(),
+            'batch_orders': list(Order.objects.order_by('pk').values_list('pk', flat=True)[:500]),
+            'address': Address.objects.get(user=shopper),
+            'import_products': list(Product.objects.select_related('category').order_by('pk')[:100]),
+            'sequence': count(),
+        }
+
+    def run(self, scenario, ctx, requests):
+        client = APIClient()
+        if scenario.user:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {ctx["tokens"][scenario.user]}')
+        send = getattr(client, scenario.method.lower())
+
+        samples, queries = [], []
+        # The first request warms up caches and lazy imports and is not timed
+        for i in range((scenario.repeat or requests) + 1):
+            if scenario.prepare:
+                scenario.prepare(ctx)
+            path = scenario.resolve(scenario.path, ctx)
+            data = scenario.resolve(scenario.data, ctx)
+            kwargs = {'format': scenario.fmt} if data is not None else {}
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = send(path, data, **kwargs) if data is not None else send(path)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - start
+            if response.status_code != scenario.status:
+                raise CommandError(f'{scenario.name} {path} returned {response.status_code}, expected {scenario.status}')
+            if i:
+                samples.append(elapsed)
+                queries.append(len(captured))
+        return {**summarize(samples), 'queries': max(queries)}
+
+    @staticmethod
+    def compare(baseline, results, options):
+        regressions = []
+        for name, current in results.items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            if current['queries'] > previous['queries']:
+                regressions.append(f'{name}: {previous["queries"]} -> {current["queries"]} queries')
+            allowed = previous['p95_ms'] * (1 + options['threshold'])
+            if current['p95_ms'] > allowed and current['p95_ms'] - previous['p95_ms'] > options['min_delta_ms']:
+                regressions.append(f'{name}: p95 {previous["p95_ms"]}ms -> {current["p95_ms"]}ms')
+        return regressions
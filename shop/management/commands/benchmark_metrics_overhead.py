@@ -0,0 +1,55 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from core.metrics import registry
+from shop.benchmarking import benchmark_database, seed_categories, seed_products, summarize
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of the metrics middleware on catalog reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=500, help='Requests per route and mode')
+
+    def handle(self, *args, **options):
+        without = [name for name in settings.MIDDLEWARE if name != 'core.metrics.MetricsMiddleware']
+        with benchmark_database():
+            seed_products(options['products'], seed_categories())
+            pk = Product.objects.values_list('pk', flat=True).first()
+            routes = ['/api/shop/products/?page_size=50', f'/api/shop/products/{pk}/', '/api/shop/categories/']
+            caches = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            report = {}
+            with override_settings(CACHES=caches):
+                for mode, middleware in (('without_metrics', without), ('with_metrics', settings.MIDDLEWARE)):
+                    with override_settings(MIDDLEWARE=middleware):
+                        report[mode] = self.run(Client(), routes, options['requests'])
+            registry.reset()
+
+        base, metered = report['without_metrics'], report['with_metrics']
+        report['overhead'] = {
+            key: round(metered[key] - base[key], 3) for key in ('p50_ms', 'p95_ms', 'p99_ms')
+        }
+        report['overhead']['mean_us_per_request'] = round(
+            (metered['seconds'] - base['seconds']) / metered['count'] * 1e6, 1
+        )
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def run(client, routes, requests):
+        for path in routes:
+            client.get(path)
+        samples = []
+        start = time.perf_counter()
+        for i in range(requests * len(routes)):
+            began = time.perf_counter()
+            response = client.get(routes[i % len(routes)])
+            samples.append(time.perf_counter() - began)
+            assert response.status_code == 200, response.status_code
+        return {**summarize(samples), 'seconds': round(time.perf_counter() - start, 3)}
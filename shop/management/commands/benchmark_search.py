@@ -0,0 +1,52 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.benchmarking import NOUNS, WORDS, benchmark_database, seed_categories, seed_products, summarize
+from shop.models import Product
+from shop.search import SearchResults
+
+
+class Command(BaseCommand):
+    help = 'Measure ranked product search latency against a large generated catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--max-p95-ms', type=float, help='Fail if the p95 latency exceeds this value')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.stdout.write(f'Seeding {options["products"]} products...')
+            seed_products(
+                options['products'], seed_categories(), seed=options['seed'],
+                log=self.stdout.write if options['verbosity'] > 1 else None
+            )
+            report = self.run_queries(options)
+
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['max_p95_ms'] is not None and report['p95_ms'] > options['max_p95_ms']:
+            raise CommandError(f'p95 {report["p95_ms"]}ms exceeds {options["max_p95_ms"]}ms')
+
+    def run_queries(self, options):
+        rng = random.Random(options['seed'] + 1)
+        queryset = Product.objects.select_related('category')
+        samples, hits = [], 0
+        for _ in range(options['queries']):
+            # Mix single-word, two-word and prefix queries
+            terms = [rng.choice(WORDS), rng.choice(NOUNS)][:rng.randint(1, 2)]
+            if rng.random() < 0.3:
+                terms[-1] = terms[-1][:3]
+            results = SearchResults(' '.join(terms), queryset)
+
+            start = time.perf_counter()
+            total = results.count()
+            page = results[0:options['page_size']]
+            samples.append(time.perf_counter() - start)
+            hits += bool(page) and total > 0
+
+        return {**summarize(samples), 'products': options['products'], 'queries_with_hits': hits}
@@ -0,0 +1,75 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from core.renderers import FastJSONRenderer
+from shop.benchmarking import benchmark_database, seed_categories, seed_products, seed_shoppers, summarize
+from shop.models import Cart, CartItem, Category, Order, OrderItem, Product
+from shop.serializers import CartSerializer, CategoryIndex, OrderSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare the generic and fast serialization/rendering paths and check their output is byte-identical'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--page-size', type=int, default=200, help='Products per rendered list')
+        parser.add_argument('--lines', type=int, default=200, help='Lines in the rendered cart and order')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_products(options['products'], seed_categories())
+            user = seed_shoppers(1, cart_items=options['lines'], orders=1, order_lines=options['lines'])[0]
+            request = Request(RequestFactory().get('/api/shop/'))
+            request.user = user
+            categories = list(Category.objects.all())
+            products = list(Product.objects.select_related('category')[:options['page_size']])
+            lines = Prefetch('items', queryset=CartItem.objects.select_related('product__category'))
+            carts = list(Cart.objects.filter(user=user).prefetch_related(lines))
+            order = Order.objects.filter(user=user).prefetch_related(
+                Prefetch('items', queryset=OrderItem.objects.select_related('product__category'))
+            ).get()
+
+            def context():
+                return {'request': request, 'category_index': CategoryIndex(categories)}
+
+            payloads = {
+                'product_list': lambda: ProductSerializer(products, many=True, context=context()).data,
+                'cart_list': lambda: CartSerializer(carts, many=True, context=context()).data,
+                'order_detail': lambda: OrderSerializer(order, context=context()).data,
+            }
+            modes = {'generic': (False, JSONRenderer()), 'fast': (True, FastJSONRenderer())}
+
+            report = {}
+            for name, build in payloads.items():
+                outputs, report[name] = {}, {}
+                for mode, (fast, renderer) in modes.items():
+                    with override_settings(SHOP_FAST_SERIALIZERS=fast):
+                        serialize, render = [], []
+                        for _ in range(options['repeat']):
+                            start = time.perf_counter()
+                            data = build()
+                            middle = time.perf_counter()
+                            outputs[mode] = renderer.render(data)
+                            render.append(time.perf_counter() - middle)
+                            serialize.append(middle - start)
+                    report[name][mode] = {
+                        'serialize': summarize(serialize),
+                        'render': summarize(render),
+                        'bytes': len(outputs[mode]),
+                    }
+                if outputs['generic'] != outputs['fast']:
+                    raise CommandError(f'{name}: fast output differs from the generic path')
+                report[name]['identical'] = True
+                generic, fast = (
+                    report[name][mode]['serialize']['p50_ms'] + report[name][mode]['render']['p50_ms'] for mode in modes
+                )
+                report[name]['speedup_p50'] = round(generic / max(fast, 1e-6), 2)
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,31 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from shop.images import _process_in_worker, get_executor
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generate resized image variants for products that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants for every product image')
+        parser.add_argument('--product', type=int, action='append', dest='products', help='Only this product id')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='')
+        if options['products']:
+            products = products.filter(pk__in=options['products'])
+        if not options['force']:
+            products = products.filter(image_variants={})
+
+        product_ids = list(products.values_list('pk', flat=True))
+        futures = {get_executor().submit(_process_in_worker, pk): pk for pk in product_ids}
+        failed = 0
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failed += 1
+                self.stderr.write(f'Product {futures[future]}: {future.exception()}')
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(product_ids) - failed} products, {failed} failed'))
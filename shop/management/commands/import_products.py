@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importing import read_rows
+from shop.importing import import_products
+
+
+class Command(BaseCommand):
+    help = 'Create or update products by slug from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = options['format'] or path.suffix.lstrip('.').lower()
+        if fmt not in ('csv', 'jsonl'):
+            raise CommandError('Cannot infer the format, pass --format csv|jsonl')
+
+        with path.open(newline='', encoding='utf-8') as stream:
+            result = import_products(read_rows(stream, fmt), chunk_size=options['chunk_size'])
+
+        for error in result['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']} products, updated {result['updated']}, "
+            f"{len(result['errors'])} errors"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses whose TTL has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Keys deleted per statement')
+
+    def handle(self, *args, **options):
+        removed = purge_expired_keys(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {removed} expired idempotency keys'))
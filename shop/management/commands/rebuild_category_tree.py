@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized path index of the category tree'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = Category.rebuild_tree(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt paths for {count} categories'))
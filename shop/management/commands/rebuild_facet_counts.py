@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop.models import ProductFacetCount
+
+
+class Command(BaseCommand):
+    help = 'Recount the product facet rollup from the products table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, action='append', dest='categories',
+                            help='Only recount this category id (repeatable)')
+
+    def handle(self, *args, **options):
+        ProductFacetCount.refresh(options['categories'])
+        self.stdout.write(self.style.SUCCESS(f'{ProductFacetCount.objects.count()} facet rows'))
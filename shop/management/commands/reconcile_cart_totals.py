@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from shop.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Detect and repair drift between denormalized cart totals and their lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted carts')
+        parser.add_argument('--all', action='store_true', help='Include inactive carts')
+
+    def handle(self, *args, **options):
+        totals = Cart.line_totals()
+        carts = Cart.objects.all() if options['all'] else Cart.objects.filter(is_active=True)
+        drifted = carts.annotate(
+            expected_count=totals['item_count'], expected_subtotal=totals['subtotal']
+        ).filter(
+            ~Q(item_count=F('expected_count')) | ~Q(subtotal=F('expected_subtotal'))
+        )
+
+        rows = list(drifted.values_list('pk', 'item_count', 'subtotal', 'expected_count', 'expected_subtotal'))
+        for pk, count, subtotal, expected_count, expected_subtotal in rows:
+            self.stdout.write(
+                f'Cart {pk}: item_count {count} -> {expected_count}, subtotal {subtotal} -> {expected_subtotal}'
+            )
+
+        if rows and not options['dry_run']:
+            Cart.objects.filter(pk__in=[row[0] for row in rows]).update(**totals)
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(rows)} carts'))
+        else:
+            self.stdout.write(f'{len(rows)} drifted carts found')
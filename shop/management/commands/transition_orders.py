@@ -0,0 +1,54 @@
+import sys
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.fulfillment import transition_orders
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Move a batch of orders to a new status, e.g. every processing order of a shipment to shipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', choices=[choice for choice, _ in Order.STATUS_CHOICES])
+        parser.add_argument('--ids', help='Comma-separated order ids')
+        parser.add_argument('--file', help='File with one order id per line, or - for stdin')
+        parser.add_argument('--from-status', help='Move every order currently in this status')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Orders per transaction')
+
+    def handle(self, *args, **options):
+        order_ids = self.order_ids(options)
+        counts = {}
+        while True:
+            chunk = list(islice(order_ids, options['chunk_size']))
+            if not chunk:
+                break
+            for result in transition_orders(chunk, options['status']):
+                counts[result['result']] = counts.get(result['result'], 0) + 1
+                if result['result'] == 'error':
+                    self.stderr.write(f"Order {result['id']}: {result['error']}")
+                elif options['verbosity'] > 1:
+                    self.stdout.write(f"Order {result['id']}: {result['result']}")
+
+        summary = ', '.join(f'{count} {result}' for result, count in sorted(counts.items())) or 'no orders'
+        self.stdout.write(self.style.SUCCESS(f"Moved orders to {options['status']}: {summary}"))
+
+    def order_ids(self, options):
+        sources = [name for name in ('ids', 'file', 'from_status') if options[name]]
+        if len(sources) != 1:
+            raise CommandError('Give exactly one of --ids, --file or --from-status')
+        try:
+            if options['ids']:
+                return iter([int(pk) for pk in options['ids'].split(',') if pk.strip()])
+            if options['file'] == '-':
+                return iter([int(line) for line in sys.stdin if line.strip()])
+            if options['file']:
+                with open(options['file']) as stream:
+                    return iter([int(line) for line in stream if line.strip()])
+        except ValueError as exc:
+            raise CommandError(f'Invalid order id: {exc}')
+        # Listed up front: the batches below change the status being selected on
+        return iter(list(
+            Order.objects.filter(status=options['from_status']).order_by('pk').values_list('pk', flat=True)
+        ))
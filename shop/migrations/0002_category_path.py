@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 07:39
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model('shop', 'Category')
+    children = {}
+    for pk, parent_id in Category.objects.values_list('pk', 'parent_id'):
+        children.setdefault(parent_id, []).append(pk)
+
+    updates = []
+    stack = [(pk, '', 0) for pk in children.get(None, [])]
+    while stack:
+        pk, parent_path, depth = stack.pop()
+        path = f"{parent_path}{pk}/"
+        updates.append(Category(pk=pk, path=path, depth=depth))
+        stack.extend((child, path, depth + 1) for child in children.get(pk, []))
+    Category.objects.bulk_update(updates, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
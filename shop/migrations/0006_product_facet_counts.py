@@ -0,0 +1,52 @@
+# Generated by Django 5.2 on 2026-10-18 07:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, Value, When
+
+PRICE_BUCKET_BOUNDS = (10, 25, 50, 100, 250, 500)
+
+
+def populate_facet_counts(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    ProductFacetCount = apps.get_model('shop', 'ProductFacetCount')
+    grouped = Product.objects.order_by().annotate(
+        bucket=Case(
+            *[When(price__lt=bound, then=Value(i)) for i, bound in enumerate(PRICE_BUCKET_BOUNDS)],
+            default=Value(len(PRICE_BUCKET_BOUNDS)),
+            output_field=models.PositiveSmallIntegerField(),
+        ),
+        has_stock=Case(When(stock__gt=0, then=Value(True)), default=Value(False)),
+    ).values('category_id', 'bucket', 'is_available', 'has_stock').annotate(total=Count('pk'))
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(
+            category_id=row['category_id'], price_bucket=row['bucket'], is_available=row['is_available'],
+            in_stock=row['has_stock'], count=row['total'],
+        )
+        for row in grouped
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('is_available', models.BooleanField()),
+                ('in_stock', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'price_bucket', 'is_available', 'in_stock'), name='unique_facet_key')],
+            },
+        ),
+        migrations.RunPython(populate_facet_counts, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,43 @@
-from django.db import models
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Concat, Greatest, Substr, TruncDate
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .search import get_search_backend
+from .images import schedule_product_image
 
 User = get_user_model()
 
+# Upper bounds of the price facet buckets; the last bucket is open-ended
+PRICE_BUCKET_BOUNDS = (10, 25, 50, 100, 250, 500)
+
+def price_bucket(price):
+    return bisect_right(PRICE_BUCKET_BOUNDS, Decimal(str(price)))
+
+def price_bucket_expression(field='price'):
+    return Case(
+        *[When(**{f'{field}__lt': bound}, then=Value(i)) for i, bound in enumerate(PRICE_BUCKET_BOUNDS)],
+        default=Value(len(PRICE_BUCKET_BOUNDS)),
+        output_field=models.PositiveSmallIntegerField(),
+    )
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='subcategories')
+    # Materialized path of ancestor ids, e.g. "1/5/12/". Maintained in save().
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -22,26 +52,78 @@ class Category(models.Model):
 
     @property
     def is_parent(self):
-        return self.parent is None
+        return self.parent_id is None
 
     @property
     def is_child(self):
-        return self.parent is not None
+        return self.parent_id is not None
+
+    def clean(self):
+        if self.pk and self.parent_id and self.parent.path.startswith(self.path):
+            raise ValidationError({'parent': 'A category cannot be moved below itself.'})
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            super().save(*args, **kwargs)
+            self.path, self.depth = self._build_path()
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+            return
+
+        # The stored path, not this instance's copy, which is stale if an ancestor moved since it was loaded
+        old_path, old_depth = Category.objects.filter(pk=self.pk).values_list('path', 'depth').first() or ('', 0)
+        self.path, self.depth = self._build_path()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and self.path != old_path:
+            kwargs['update_fields'] = set(update_fields) | {'path', 'depth'}
+        super().save(*args, **kwargs)
+
+        if old_path and self.path != old_path:
+            # Category was moved: rewrite the path prefix of the whole subtree in one UPDATE
+            Category.objects.filter(
+                path__gt=old_path, path__lt=old_path[:-1] + '0'
+            ).update(
+                path=Concat(models.Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=models.F('depth') + (self.depth - old_depth),
+            )
+
+    def _build_path(self):
+        if self.parent_id is None:
+            return f"{self.pk}/", 0
+        parent_path, parent_depth = Category.objects.filter(pk=self.parent_id).values_list('path', 'depth').get()
+        return f"{parent_path}{self.pk}/", parent_depth + 1
+
+    def subtree_q(self, prefix=''):
+        """Q matching this category and all its descendants using a range scan on the path index."""
+        # '0' sorts directly after '/', so [path, path[:-1] + '0') covers exactly the subtree
+        return Q(**{f'{prefix}path__gte': self.path, f'{prefix}path__lt': self.path[:-1] + '0'})
 
     def get_ancestors(self):
-        ancestors = []
-        current = self
-        while current.parent:
-            current = current.parent
-            ancestors.append(current)
-        return ancestors[::-1]  # Return in order from top to bottom
+        ancestor_ids = [int(pk) for pk in self.path.split('/')[:-2]]
+        if not ancestor_ids:
+            return []
+        return list(Category.objects.filter(pk__in=ancestor_ids).order_by('depth'))
 
     def get_descendants(self):
-        descendants = []
-        for subcategory in self.subcategories.all():
-            descendants.append(subcategory)
-            descendants.extend(subcategory.get_descendants())
-        return descendants
+        return Category.objects.filter(self.subtree_q()).exclude(pk=self.pk).order_by('path')
+
+    @classmethod
+    def rebuild_tree(cls, batch_size=1000):
+        """Recompute path and depth for every category. Returns the number of rows updated."""
+        children = {}
+        for pk, parent_id in cls.objects.values_list('pk', 'parent_id'):
+            children.setdefault(parent_id, []).append(pk)
+
+        updates = []
+        stack = [(pk, '', 0) for pk in children.get(None, [])]
+        while stack:
+            pk, parent_path, depth = stack.pop()
+            path = f"{parent_path}{pk}/"
+            updates.append(cls(pk=pk, path=path, depth=depth))
+            stack.extend((child, path, depth + 1) for child in children.get(pk, []))
+
+        cls.objects.bulk_update(updates, ['path', 'depth'], batch_size=batch_size)
+        bump_catalog_version()
+        return len(updates)
 
 class Product(models.Model):
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
@@ -51,25 +133,190 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to='products/', blank=True)
+    # {format: {width: storage name}} of resized derivatives, filled in by shop.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_available = models.BooleanField(default=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Catalog listing and its cursor pagination, with and without a category filter
+            models.Index(fields=['-created_at', 'id'], name='product_created_idx'),
+            models.Index(fields=['category', 'is_available', '-created_at'], name='product_category_listing_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_price = instance.__dict__.get('price')
+        instance._loaded_image = instance.__dict__.get('image')
+        if {'category_id', 'price', 'is_available', 'stock'} <= instance.__dict__.keys():
+            instance._loaded_facet_key = instance.facet_key()
+        return instance
+
+    def facet_key(self):
+        return (self.category_id, price_bucket(self.price), self.is_available, self.stock > 0)
+
+    def save(self, *args, **kwargs):
+        loaded_price = getattr(self, '_loaded_price', None)
+        loaded_facet_key = getattr(self, '_loaded_facet_key', None)
+        image_changed = self.image.name != getattr(self, '_loaded_image', None)
+        if image_changed and hasattr(self, '_loaded_image'):
+            # Derivatives of the previous image must not outlive it, even if the new one fails to process
+            self.image_variants = {}
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'image' in update_fields:
+                kwargs['update_fields'] = {*update_fields, 'image_variants'}
+        super().save(*args, **kwargs)
+        if loaded_price is not None and self.price != loaded_price:
+            # Carts holding this product carry a stale subtotal
+            Cart.objects.filter(items__product=self).update(**Cart.line_totals())
+        facet_key = self.facet_key()
+        if facet_key != loaded_facet_key:
+            if loaded_facet_key is not None:
+                ProductFacetCount.adjust(loaded_facet_key, -1)
+            ProductFacetCount.adjust(facet_key, 1)
+        if self.image and image_changed:
+            schedule_product_image(self.pk)
+        self._loaded_price = self.price
+        self._loaded_facet_key = facet_key
+        self._loaded_image = self.image.name
+
+class ProductFacetCount(models.Model):
+    """Rollup of product counts per combination of facet values.
+
+    Kept current incrementally by Product.save(), product deletion and checkout;
+    refresh() recounts from the products table.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    price_bucket = models.PositiveSmallIntegerField()
+    is_available = models.BooleanField()
+    in_stock = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['category', 'price_bucket', 'is_available', 'in_stock'], name='unique_facet_key'
+            ),
+        ]
+
+    @classmethod
+    def adjust(cls, key, delta):
+        category_id, bucket, is_available, in_stock = key
+        lookup = {
+            'category_id': category_id, 'price_bucket': bucket,
+            'is_available': is_available, 'in_stock': in_stock,
+        }
+        if cls.objects.filter(**lookup).update(count=F('count') + delta) or delta < 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(count=delta, **lookup)
+        except IntegrityError:
+            # Created concurrently by another writer
+            cls.objects.filter(**lookup).update(count=F('count') + delta)
+
+    @classmethod
+    def record_sold_out(cls, product_ids):
+        """Move products whose stock just reached zero to the out-of-stock facet."""
+        sold_out = Product.objects.filter(pk__in=product_ids, stock=0).values_list(
+            'category_id', 'price', 'is_available'
+        )
+        for category_id, price, is_available in sold_out:
+            cls.adjust((category_id, price_bucket(price), is_available, True), -1)
+            cls.adjust((category_id, price_bucket(price), is_available, False), 1)
+        return len(sold_out)
+
+    @classmethod
+    def refresh(cls, category_ids=None):
+        """Recount the rollup from products, for all categories or only the given ones."""
+        products = Product.objects.order_by()
+        rows = cls.objects.all()
+        if category_ids is not None:
+            products = products.filter(category_id__in=category_ids)
+            rows = rows.filter(category_id__in=category_ids)
+        grouped = products.annotate(
+            bucket=price_bucket_expression(),
+            has_stock=Case(When(stock__gt=0, then=Value(True)), default=Value(False)),
+        ).values('category_id', 'bucket', 'is_available', 'has_stock').annotate(total=Count('pk'))
+
+        with transaction.atomic():
+            rows.delete()
+            cls.objects.bulk_create([
+                cls(
+                    category_id=row['category_id'], price_bucket=row['bucket'], is_available=row['is_available'],
+                    in_stock=row['has_stock'], count=row['total'],
+                )
+                for row in grouped
+            ], batch_size=1000)
+
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='carts')
+    # Denormalized from the cart lines; kept in sync by line_totals()
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_active'], name='cart_user_active_idx'),
+        ]
+
     def __str__(self):
         return f"Cart {self.id} - {self.user.username}"
 
+    def apply_item_changes(self, changes):
+        """Upsert cart lines from {product_id: (mode, value)} where mode is 'set' or 'add'.
+
+        Lines are changed with row-level F() arithmetic, so concurrent callers never
+        lose each other's updates. Lines that reach zero are removed. Call inside a
+        transaction.
+        """
+        CartItem.objects.bulk_create(
+            [CartItem(cart=self, product_id=product_id, quantity=0) for product_id in changes],
+            ignore_conflicts=True,
+        )
+        quantity_field = models.PositiveIntegerField()
+        whens = [
+            When(product_id=product_id, then=(
+                Value(value) if mode == 'set'
+                else Greatest(F('quantity') + value, 0, output_field=quantity_field)
+            ))
+            for product_id, (mode, value) in changes.items()
+        ]
+        lines = CartItem.objects.filter(cart=self, product_id__in=changes)
+        lines.update(
+            quantity=Case(*whens, default=F('quantity'), output_field=quantity_field),
+            updated_at=timezone.now(),
+        )
+        lines.filter(quantity=0).delete()
+        Cart.objects.filter(pk=self.pk).update(**Cart.line_totals())
+
+    @staticmethod
+    def line_totals(exclude_product=None):
+        """Update expressions that recompute item_count and subtotal from the cart lines."""
+        lines = CartItem.objects.filter(cart=OuterRef('pk'))
+        if exclude_product is not None:
+            lines = lines.exclude(product=exclude_product)
+        lines = lines.order_by().values('cart')
+        count = lines.annotate(total=Sum('quantity')).values('total')
+        amount = lines.annotate(total=Sum(F('quantity') * F('product__price'))).values('total')
+        return {
+            'item_count': Coalesce(Subquery(count), 0),
+            'subtotal': Coalesce(
+                Subquery(amount, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+                Decimal('0.00'),
+            ),
+        }
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -77,6 +324,11 @@ class CartItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
 
@@ -96,9 +348,29 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Order history, newest first, in OrderCursorPagination order
+            models.Index(fields=['user', '-created_at', 'id'], name='order_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} - {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        loaded_status = getattr(self, '_loaded_status', None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if loaded_status is not None and self.status != loaded_status:
+                record_status_change(Order.objects.filter(pk=self.pk), loaded_status, self.status)
+        self._loaded_status = self.status
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -108,3 +380,140 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} - {self.order.id}"
+
+class DailyProductSales(models.Model):
+    """Units and revenue per product per day, excluding cancelled orders."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_daily_product_sales'),
+        ]
+
+class DailyCategorySales(models.Model):
+    """Units and revenue per (direct) product category per day, excluding cancelled orders."""
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='unique_daily_category_sales'),
+        ]
+
+class DailyOrderStatusCount(models.Model):
+    """Number of orders placed on a day that are currently in each status."""
+    date = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'status'], name='unique_daily_order_status'),
+        ]
+
+class IdempotencyKey(models.Model):
+    """Outcome of an unsafe request made with an Idempotency-Key header, see shop.idempotency.
+
+    A row without a status_code is a claim held by the request still running.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response_data = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+def increment_rollup(model, key_field, deltas):
+    """Add {(date, key): {field: delta}} to a rollup table with two set-based queries per date."""
+    by_date = {}
+    for (date, key), values in deltas.items():
+        by_date.setdefault(date, {})[key] = values
+    for date, rows in by_date.items():
+        model.objects.bulk_create([model(date=date, **{key_field: key}) for key in rows], ignore_conflicts=True)
+        fields = {name for values in rows.values() for name in values}
+        model.objects.filter(date=date, **{f'{key_field}__in': rows}).update(**{
+            name: F(name) + Case(
+                *[When(**{key_field: key}, then=Value(values.get(name, 0))) for key, values in rows.items()],
+                default=Value(0),
+                output_field=model._meta.get_field(name),
+            )
+            for name in fields
+        })
+
+def record_order_sales(orders, sign=1):
+    """Add (sign=1) or remove (sign=-1) the lines of the given orders from the sales rollups."""
+    lines = OrderItem.objects.filter(order__in=orders).order_by().annotate(
+        day=TruncDate('order__created_at')
+    ).values('day', 'product_id', 'product__category_id').annotate(
+        units=Sum('quantity'), revenue=Sum(F('quantity') * F('price'))
+    )
+    products, categories = {}, {}
+    for line in lines:
+        for deltas, key in ((products, line['product_id']), (categories, line['product__category_id'])):
+            values = deltas.setdefault((line['day'], key), {'units': 0, 'revenue': Decimal('0')})
+            values['units'] += sign * line['units']
+            values['revenue'] += sign * line['revenue']
+    increment_rollup(DailyProductSales, 'product_id', products)
+    increment_rollup(DailyCategorySales, 'category_id', categories)
+
+def record_order_status(orders, sign=1):
+    counts = orders.order_by().annotate(day=TruncDate('created_at')).values('day', 'status').annotate(
+        total=Count('pk')
+    )
+    increment_rollup(DailyOrderStatusCount, 'status', {
+        (row['day'], row['status']): {'orders': sign * row['total']} for row in counts
+    })
+
+def record_status_change(orders, old_status, new_status):
+    """Update the rollups for orders that just moved from old_status to new_status."""
+    counts = orders.order_by().annotate(day=TruncDate('created_at')).values('day').annotate(total=Count('pk'))
+    deltas = {}
+    for row in counts:
+        deltas[(row['day'], old_status)] = {'orders': -row['total']}
+        deltas[(row['day'], new_status)] = {'orders': row['total']}
+    increment_rollup(DailyOrderStatusCount, 'status', deltas)
+    if new_status == 'cancelled' and old_status != 'cancelled':
+        record_order_sales(orders, -1)
+    elif old_status == 'cancelled' and new_status != 'cancelled':
+        record_order_sales(orders, 1)
+
+@receiver(pre_delete, sender=Order)
+def remove_order_from_rollups(sender, instance, **kwargs):
+    orders = Order.objects.filter(pk=instance.pk)
+    record_order_status(orders, -1)
+    record_order_sales(orders.exclude(status='cancelled'), -1)
+
+@receiver(pre_delete, sender=Product)
+def remove_product_from_cart_totals(sender, instance, **kwargs):
+    # The cascade is about to drop this product's cart lines
+    Cart.objects.filter(items__product=instance).update(**Cart.line_totals(exclude_product=instance))
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index([instance])
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_facets(sender, instance, **kwargs):
+    ProductFacetCount.adjust(getattr(instance, '_loaded_facet_key', None) or instance.facet_key(), -1)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
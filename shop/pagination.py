@@ -0,0 +1,94 @@
+from django.db.models import Q
+from rest_framework.pagination import CursorPagination, PageNumberPagination, _reverse_ordering
+
+
+class KeysetCursorPagination(CursorPagination):
+    """CursorPagination whose cursor holds the whole ordering, not just its first field.
+
+    DRF positions the cursor on the first ordering field and steps over rows
+    that tie on it with an offset, which rescans the ties on every page and
+    skips rows when paging backwards through them. Here the position is the
+    full key, so the ordering must be unique (end it with the primary key).
+    """
+    separator = '|'
+
+    def _get_position_from_instance(self, instance, ordering):
+        return self.separator.join(str(getattr(instance, field.lstrip('-'))) for field in ordering)
+
+    def _keyset_q(self, position, reverse):
+        # (a, b) after (x, y) is a > x OR (a = x AND b > y), with > flipped per descending field
+        values = position.split(self.separator, len(self.ordering) - 1)
+        query, equal = Q(), {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            query |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return query
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self._keyset_q(current_position, reverse))
+
+        # One extra row tells whether there is a following page
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = (current_position is not None) or (offset > 0)
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    # id breaks ties between products created in the same instant
+    ordering = ('-created_at', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    ordering = ('-created_at', 'id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SearchPagination(PageNumberPagination):
+    # Ranked results have no stable sort key to build a cursor from
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,32 @@
+"""EXPLAIN QUERY PLAN capture, for catching hot queries that lose their index."""
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+def query_plan(sql, using=DEFAULT_DB_ALIAS):
+    """Detail lines of SQLite's plan for an already interpolated statement."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    """Tables read start to end without an index, e.g. "SCAN shop_product"."""
+    return [
+        detail.split()[1] for detail in plan
+        if detail.startswith('SCAN ') and ' USING ' not in detail and 'VIRTUAL TABLE' not in detail
+        and detail not in ('SCAN CONSTANT ROW',) and not detail.startswith('SCAN (')
+    ]
+
+
+@contextmanager
+def capture_query_plans(using=DEFAULT_DB_ALIAS):
+    """Collect (sql, plan) for every SELECT run inside the block."""
+    plans = []
+    with CaptureQueriesContext(connections[using]) as captured:
+        yield plans
+    for query in captured.captured_queries:
+        if query['sql'].lstrip().upper().startswith('SELECT'):
+            plans.append((query['sql'], query_plan(query['sql'], using)))
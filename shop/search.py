@@ -0,0 +1,144 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, connections
+from django.utils.module_loading import import_string
+
+from core.routers import read_alias
+
+FTS_TABLE = 'shop_product_fts'
+
+
+class SearchBackend:
+    """Interface of product search engines; see SHOP_SEARCH_BACKEND."""
+
+    def index(self, products):
+        raise NotImplementedError
+
+    def remove(self, product_ids):
+        raise NotImplementedError
+
+    def rebuild(self, queryset, batch_size=1000):
+        raise NotImplementedError
+
+    def search(self, query, offset=0, limit=20, queryset=None):
+        """Return product ids matching query, best match first.
+
+        When queryset is given, only products in it are searched and counted.
+        """
+        raise NotImplementedError
+
+    def count(self, query, queryset=None):
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """Ranked search over an FTS5 table whose rowid is the product id."""
+
+    # bm25 column weights: a hit in the name counts ten times a hit in the description
+    weights = (10.0, 1.0)
+
+    @staticmethod
+    def to_match(query):
+        # Quote every term so user input can never be parsed as FTS syntax; the last term is a prefix
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def index(self, products):
+        rows = [(product.pk, product.name, product.description) for product in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self, queryset, batch_size=1000):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        rows = queryset.order_by().values_list('pk', 'name', 'description').iterator(chunk_size=batch_size)
+        batch, total = [], 0
+        with connection.cursor() as cursor:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', batch)
+                total += len(batch)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        return total
+
+    @staticmethod
+    def restrict(queryset, alias):
+        """SQL condition and params limiting FTS rows to the products of queryset."""
+        if queryset is None or not queryset.query.where:
+            return '', []
+        sql, params = queryset.order_by().values('pk').query.get_compiler(using=alias).as_sql()
+        return f' AND rowid IN ({sql})', list(params)
+
+    def search(self, query, offset=0, limit=20, queryset=None):
+        match = self.to_match(query)
+        if match is None:
+            return []
+        alias = read_alias()
+        restriction, params = self.restrict(queryset, alias)
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s{restriction} '
+                f'ORDER BY bm25({FTS_TABLE}, {", ".join(map(str, self.weights))}) LIMIT %s OFFSET %s',
+                [match, *params, limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def count(self, query, queryset=None):
+        match = self.to_match(query)
+        if match is None:
+            return 0
+        alias = read_alias()
+        restriction, params = self.restrict(queryset, alias)
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s{restriction}', [match, *params]
+            )
+            return cursor.fetchone()[0]
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    return import_string(getattr(settings, 'SHOP_SEARCH_BACKEND', 'shop.search.SQLiteFTSBackend'))()
+
+
+class SearchResults:
+    """Lazy, sliceable view of ranked search hits that Django's Paginator can consume.
+
+    Hits are restricted to queryset inside the search query, so count() and
+    every page agree with the filters applied to it.
+    """
+
+    def __init__(self, query, queryset, backend=None):
+        self.query = query
+        self.queryset = queryset
+        self.backend = backend or get_search_backend()
+
+    def count(self):
+        return self.backend.count(self.query, queryset=self.queryset)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('SearchResults only supports slicing')
+        offset = key.start or 0
+        ids = self.backend.search(self.query, offset=offset, limit=key.stop - offset, queryset=self.queryset)
+        products = self.queryset.in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
@@ -1,8 +1,186 @@
+from operator import attrgetter
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from django.db import models
 from rest_framework import serializers
 from .models import Category, Product, Cart, CartItem, Order, OrderItem
+from .images import srcset
 from users.models import UserProfile
 
-class CategorySerializer(serializers.ModelSerializer):
+
+class CategoryIndex:
+    """One-query snapshot of the category tree shared by all serializers of a response."""
+
+    def __init__(self, queryset=None):
+        self.queryset = Category.objects.all() if queryset is None else queryset
+        self.serialized = {}
+        self._children = None
+        self._names = None
+
+    def _load(self):
+        if self._children is None:
+            self._children, self._names = {}, {}
+            for category in self.queryset:
+                self._names[category.pk] = category.name
+                self._children.setdefault(category.parent_id, []).append(category)
+
+    def children(self, pk):
+        self._load()
+        return self._children.get(pk, [])
+
+    def name(self, pk):
+        self._load()
+        return self._names.get(pk)
+
+
+def build_category_tree(rows):
+    """Assemble nested category dicts from flat rows in O(n).
+
+    Rows must be ordered so that every parent precedes its children.
+    """
+    nodes, roots = {}, []
+    for row in rows:
+        node = nodes[row['id']] = {**row, 'children': []}
+        parent = nodes.get(row['parent'])
+        if parent is not None:
+            parent['children'].append(node)
+        else:
+            roots.append(node)
+    return roots
+
+
+def parse_shape(value):
+    """Parse "id,category.name" into {'id': {}, 'category': {'name': {}}}; None if empty."""
+    tree = {}
+    for path in filter(None, (path.strip() for path in (value or '').split(','))):
+        node = tree
+        for part in path.split('.'):
+            node = node.setdefault(part, {})
+    return tree or None
+
+
+class ShapedSerializerMixin:
+    """Output shaped by sparse fieldsets, as parsed by parse_shape().
+
+    ``fields`` keeps only the named fields; names with children shape a nested
+    serializer and imply its expansion. Relations in ``expandable_fields``
+    render as primary keys unless named in ``expand``. Other nested
+    serializers inherit the shape under their name.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        self.sparse_fields = fields
+        self.expand = expand or {}
+        super().__init__(*args, **kwargs)
+
+    @cached_property
+    def shape_key(self):
+        return repr((self.sparse_fields, self.expand))
+
+    def nested_shape(self, name):
+        fields = self.sparse_fields.get(name) if self.sparse_fields else None
+        return {'fields': fields or None, 'expand': self.expand.get(name)}
+
+    def is_expanded(self, name):
+        return name in self.expand or bool(self.sparse_fields and self.sparse_fields.get(name))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name, field in fields.items():
+            if name in self.expandable_fields:
+                if self.is_expanded(name):
+                    fields[name] = self.expandable_fields[name](read_only=True, **self.nested_shape(name))
+                else:
+                    fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+                continue
+            child = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(child, ShapedSerializerMixin):
+                shape = self.nested_shape(name)
+                child.sparse_fields, child.expand = shape['fields'], shape['expand'] or {}
+        if self.sparse_fields is not None:
+            # Write-only fields stay so that ?fields= never changes what a write accepts
+            fields = {
+                name: field for name, field in fields.items() if name in self.sparse_fields or field.write_only
+            }
+        return fields
+
+
+class CompiledRepresentation:
+    """Precompiled equivalent of a bound serializer's to_representation().
+
+    Fields are resolved once, so each row costs one accessor call per field
+    instead of the generic get_attribute/to_representation walk. Nested objects
+    are memoized by primary key for the lifetime of the instance (one
+    response) and nested lists are compiled recursively.
+    """
+
+    def __init__(self, serializer):
+        self.accessors = [self._compile(field) for field in serializer._readable_fields]
+
+    def __call__(self, instance):
+        row = {}
+        for name, get, to_representation in self.accessors:
+            value = get(instance)
+            row[name] = value if value is None or to_representation is None else to_representation(value)
+        return row
+
+    def _compile(self, field):
+        if isinstance(field, serializers.SerializerMethodField):
+            return field.field_name, getattr(field.parent, field.method_name), None
+        if field.source == '*':
+            return field.field_name, lambda instance: instance, field.to_representation
+
+        get = attrgetter('.'.join(field.source_attrs))
+        if isinstance(field, serializers.ListSerializer):
+            child = CompiledRepresentation(field.child)
+
+            def nested_list(instance):
+                value = get(instance)
+                if isinstance(value, models.manager.BaseManager):
+                    value = value.all()
+                return [child(item) for item in value]
+            return field.field_name, nested_list, None
+
+        if isinstance(field, serializers.BaseSerializer):
+            child, memo = CompiledRepresentation(field), {}
+
+            def nested(instance):
+                value = get(instance)
+                if value is None:
+                    return None
+                if value.pk not in memo:
+                    memo[value.pk] = child(value)
+                return memo[value.pk]
+            return field.field_name, nested, None
+
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+            source = field.source
+            return field.field_name, lambda instance: instance.serializable_value(source), None
+        return field.field_name, get, field.to_representation
+
+
+class FastListSerializer(serializers.ListSerializer):
+    """ListSerializer that reads through a CompiledRepresentation of its child.
+
+    The output is identical to the generic path, which SHOP_FAST_SERIALIZERS = False restores.
+    """
+
+    def to_representation(self, data):
+        if not getattr(settings, 'SHOP_FAST_SERIALIZERS', True):
+            return super().to_representation(data)
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        # Compiled once per response: nested lists of the same serializer reuse it
+        cache = self.context.setdefault('compiled_representations', {})
+        key = (type(self.child), getattr(self.child, 'shape_key', None))
+        compiled = cache.get(key)
+        if compiled is None:
+            compiled = cache[key] = CompiledRepresentation(self.child)
+        return [compiled(item) for item in iterable]
+
+
+class CategorySerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     subcategories = serializers.SerializerMethodField()
     parent_name = serializers.SerializerMethodField()
     is_parent = serializers.SerializerMethodField()
@@ -12,13 +190,39 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name', 'slug', 'description', 'parent', 'parent_name',
                  'is_parent', 'is_child', 'subcategories', 'created_at']
+        list_serializer_class = FastListSerializer
+
+    def validate_parent(self, value):
+        if value and self.instance and value.path.startswith(self.instance.path):
+            raise serializers.ValidationError('A category cannot be moved below itself.')
+        return value
 
     def get_subcategories(self, obj):
-        serializer = CategorySerializer(obj.subcategories.all(), many=True)
-        return serializer.data
+        index = self.context.get('category_index')
+        if not self.is_expanded('subcategories'):
+            if index is None:
+                return list(obj.subcategories.values_list('pk', flat=True))
+            return [child.pk for child in index.children(obj.pk)]
+
+        # Expanded subcategories are recursive and share this serializer's shape
+        shape = {'fields': self.sparse_fields, 'expand': self.expand}
+        if index is None:
+            serializer = CategorySerializer(obj.subcategories.all(), many=True, **shape)
+            return serializer.data
+        # Each subtree is serialized once and reused by every ancestor that embeds it
+        key = (self.shape_key, obj.pk)
+        if key not in index.serialized:
+            serializer = CategorySerializer(index.children(obj.pk), many=True, context=self.context, **shape)
+            index.serialized[key] = serializer.data
+        return index.serialized[key]
 
     def get_parent_name(self, obj):
-        return obj.parent.name if obj.parent else None
+        if obj.parent_id is None:
+            return None
+        index = self.context.get('category_index')
+        if index is not None:
+            return index.name(obj.parent_id)
+        return obj.parent.name
 
     def get_is_parent(self, obj):
         return obj.is_parent
@@ -26,20 +230,30 @@ class CategorySerializer(serializers.ModelSerializer):
     def get_is_child(self, obj):
         return obj.is_child
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(),
         source='category',
         write_only=True
     )
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = ['id', 'name', 'slug', 'description', 'price', 'stock', 
-                 'image', 'is_available', 'category', 'category_id']
+                 'image', 'image_srcset', 'is_available', 'category', 'category_id']
+        list_serializer_class = FastListSerializer
+
+    expandable_fields = {'category': CategorySerializer}
+    # Model columns each field reads, for trimming querysets to the requested fields
+    field_columns = {'image_srcset': ('image_variants',), 'category': ('category',)}
+
+    def get_image_srcset(self, obj):
+        request = self.context.get('request')
+        return srcset(obj.image_variants, request.build_absolute_uri if request else None)
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(),
@@ -50,26 +264,74 @@ class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'product_id', 'quantity']
+        list_serializer_class = FastListSerializer
 
-class CartSerializer(serializers.ModelSerializer):
+    expandable_fields = {'product': ProductSerializer}
+
+class CartItemOperationSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
+    delta = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if ('quantity' in attrs) == ('delta' in attrs):
+            raise serializers.ValidationError('Provide exactly one of quantity or delta.')
+        return attrs
+
+class BulkCartItemSerializer(serializers.Serializer):
+    items = CartItemOperationSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_items(self, items):
+        product_ids = {item['product_id'] for item in items}
+        found = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        missing = sorted(product_ids - found)
+        if missing:
+            raise serializers.ValidationError(f'Unknown product ids: {missing}')
+        return items
+
+    def get_changes(self):
+        """Collapse the operations, in order, into one (mode, value) change per product."""
+        changes = {}
+        for item in self.validated_data['items']:
+            product_id = item['product_id']
+            if 'quantity' in item:
+                changes[product_id] = ('set', item['quantity'])
+            else:
+                mode, value = changes.get(product_id, ('add', 0))
+                value += item['delta']
+                changes[product_id] = (mode, max(value, 0) if mode == 'set' else value)
+        return changes
+
+class BulkOrderStatusSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=10000
+    )
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+
+class CartSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'items', 'total', 'created_at']
+        fields = ['id', 'items', 'item_count', 'total', 'created_at']
+        read_only_fields = ['item_count']
+        list_serializer_class = FastListSerializer
 
     def get_total(self, obj):
-        return sum(item.product.price * item.quantity for item in obj.items.all())
+        return obj.subtotal
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
 
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'quantity', 'price']
+        list_serializer_class = FastListSerializer
+
+    expandable_fields = {'product': ProductSerializer}
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     shipping_address = serializers.PrimaryKeyRelatedField(
         queryset=UserProfile.objects.none(),  # This will be set in the view
@@ -80,12 +342,23 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['id', 'status', 'total_amount', 'shipping_address', 
                  'created_at', 'items']
+        list_serializer_class = FastListSerializer
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        if 'request' in self.context:
+        if 'request' in self.context and 'shipping_address' in self.fields:
             self.fields['shipping_address'].queryset = self.context['request'].user.addresses.all()
 
+class OrderSummarySerializer(ShapedSerializerMixin, serializers.ModelSerializer):
+    """Compact order representation for history listings; expects the annotations
+    added by OrderViewSet.get_queryset()."""
+    item_count = serializers.IntegerField(read_only=True)
+    first_item_name = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'total_amount', 'item_count', 'first_item_name', 'created_at']
+
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
@@ -1,3 +1,977 @@
-from django.test import TestCase
+import json
+from contextvars import copy_context
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from core.renderers import FastJSONRenderer
+from core.routers import PIN_COOKIE, PrimaryReplicaRouter, ReplicaPinningMiddleware
+from users.models import Address
+from .models import (
+    Category, Product, Cart, CartItem, Order, OrderItem, ProductFacetCount, DailyOrderStatusCount, DailyProductSales,
+    IdempotencyKey, record_order_sales, record_order_status
+)
+from .cache import get_cache_stats, reset_cache_stats
+from .queryplan import capture_query_plans, full_scans
+
+
+class CheckoutTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='secret-pass')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Books', slug='books')
+
+    def make_cart(self, lines, stock=10):
+        cart = Cart.objects.create(user=self.user)
+        for i in range(lines):
+            product = Product.objects.create(
+                category=self.category, name=f'Product {cart.pk}-{i}', slug=f'product-{cart.pk}-{i}',
+                description='', price='2.50', stock=stock
+            )
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        return cart
+
+    def checkout_query_count(self, lines):
+        cart = self.make_cart(lines)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/shop/orders/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['items']), lines)
+        cart.refresh_from_db()
+        self.assertFalse(cart.is_active)
+        return len(queries)
+
+    def test_query_count_is_independent_of_cart_size(self):
+        self.assertEqual(self.checkout_query_count(1), self.checkout_query_count(50))
+
+    def test_checkout_decrements_stock(self):
+        self.make_cart(3, stock=5)
+        response = self.client.post('/api/shop/orders/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_amount'], '15.00')
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {3})
+
+    def test_checkout_refreshes_cached_stock(self):
+        cache.clear()
+        cart = self.make_cart(1, stock=5)
+        path = f'/api/shop/products/{cart.items.get().product_id}/'
+        self.assertEqual(self.client.get(path).data['stock'], 5)
+        self.assertEqual(self.client.get(path)['X-Cache'], 'HIT')
+
+        self.client.post('/api/shop/orders/', {}, format='json')
+        response = self.client.get(path)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['stock'], 3)
+
+    def test_oversell_is_rejected_atomically(self):
+        cart = self.make_cart(2, stock=5)
+        short = cart.items.first().product
+        Product.objects.filter(pk=short.pk).update(stock=1)
+
+        response = self.client.post('/api/shop/orders/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['products'], [short.pk])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(sorted(Product.objects.values_list('stock', flat=True)), [1, 5])
+        cart.refresh_from_db()
+        self.assertTrue(cart.is_active)
+
+    def test_oversell_reports_only_the_short_products(self):
+        cart = self.make_cart(2, stock=3)
+        enough, short = [line.product for line in cart.items.order_by('pk')]
+        Product.objects.filter(pk=short.pk).update(stock=1)
+
+        response = self.client.post('/api/shop/orders/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['products'], [short.pk])
+        self.assertEqual(Product.objects.get(pk=enough.pk).stock, 3)
+
+    def test_empty_cart(self):
+        Cart.objects.create(user=self.user)
+        response = self.client.post('/api/shop/orders/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retry_with_idempotency_key_replays_the_order(self):
+        self.make_cart(2, stock=5)
+        first = self.client.post('/api/shop/orders/', {}, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.client.post('/api/shop/orders/', {}, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+        reused = self.client.post(
+            '/api/shop/orders/', {'shipping_address': 1}, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1'
+        )
+        self.assertEqual(reused.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+class CartTotalsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='secret-pass')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Books', slug='books')
+        self.products = [
+            Product.objects.create(
+                category=category, name=f'Book {i}', slug=f'book-{i}', description='', price=price, stock=10
+            )
+            for i, price in enumerate(('2.50', '4.00'))
+        ]
+        self.cart = Cart.objects.create(user=self.user)
+
+    def add(self, product, quantity):
+        return self.client.post(
+            f'/api/shop/cart/{self.cart.pk}/add_item/', {'product_id': product.pk, 'quantity': quantity},
+            format='json'
+        )
+
+    def assertTotals(self, item_count, subtotal):
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, str(self.cart.subtotal)), (item_count, subtotal))
+
+    def test_add_and_remove(self):
+        self.add(self.products[0], 2)
+        self.add(self.products[1], 1)
+        self.add(self.products[0], 1)
+        self.assertTotals(4, '11.50')
+        response = self.client.post(
+            f'/api/shop/cart/{self.cart.pk}/remove_item/', {'product_id': self.products[0].pk}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTotals(1, '4.00')
+
+    def test_reprice_and_product_delete(self):
+        self.add(self.products[0], 2)
+        self.add(self.products[1], 1)
+        self.products[0].price = '3.00'
+        self.products[0].save()
+        self.assertTotals(3, '10.00')
+        self.products[1].delete()
+        self.assertTotals(2, '6.00')
+
+    def test_reconcile_repairs_drift(self):
+        self.add(self.products[0], 2)
+        Cart.objects.filter(pk=self.cart.pk).update(item_count=7, subtotal='1.00')
+        call_command('reconcile_cart_totals', '--dry-run', stdout=StringIO())
+        self.assertTotals(7, '1.00')
+        out = StringIO()
+        call_command('reconcile_cart_totals', stdout=out)
+        self.assertIn('Repaired 1 carts', out.getvalue())
+        self.assertTotals(2, '5.00')
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='secret-pass')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            category=category, name='Book', slug='book', description='', price='2.50', stock=10
+        )
+        self.cart = Cart.objects.create(user=self.user)
+
+    def add(self, quantity, key):
+        return self.client.post(
+            f'/api/shop/cart/{self.cart.pk}/add_item/', {'product_id': self.product.pk, 'quantity': quantity},
+            format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def quantity(self):
+        return CartItem.objects.get(cart=self.cart, product=self.product).quantity
+
+    def test_add_item_replays_the_first_response(self):
+        first = self.add(2, 'retry-1')
+        retry = self.add(2, 'retry-1')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(self.quantity(), 2)
+        self.assertEqual(self.add(3, 'retry-1').status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_late_retry_does_not_take_over_a_running_claim(self):
+        self.add(1, 'first')
+        # A claim older than the retry wait but within its lease belongs to a request still running
+        now = timezone.now()
+        IdempotencyKey.objects.create(
+            user=self.user, key='retry-1', fingerprint=IdempotencyKey.objects.get(key='first').fingerprint,
+            created_at=now - timedelta(seconds=60), expires_at=now + timedelta(days=1)
+        )
+        self.assertEqual(self.add(1, 'retry-1').status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.quantity(), 1)
+
+
+class CategoryTreeTests(APITestCase):
+    def setUp(self):
+        self.home = Category.objects.create(name='Home', slug='home')
+        self.garden = Category.objects.create(name='Garden', slug='garden')
+        self.lighting = Category.objects.create(name='Lighting', slug='lighting', parent=self.home)
+        self.lamps = Category.objects.create(name='Lamps', slug='lamps', parent=self.lighting)
+        self.bulbs = Category.objects.create(name='Bulbs', slug='bulbs', parent=self.lamps)
+
+    def assertPath(self, category, path, depth):
+        category.refresh_from_db()
+        self.assertEqual((category.path, category.depth), (path, depth))
+
+    def test_paths_ancestors_and_descendants(self):
+        self.assertPath(self.bulbs, f'{self.home.pk}/{self.lighting.pk}/{self.lamps.pk}/{self.bulbs.pk}/', 3)
+        self.assertEqual(self.bulbs.get_ancestors(), [self.home, self.lighting, self.lamps])
+        self.assertEqual(self.home.get_ancestors(), [])
+        self.assertEqual(list(self.home.get_descendants()), [self.lighting, self.lamps, self.bulbs])
+        self.assertEqual(list(self.garden.get_descendants()), [])
+
+    def test_moving_a_category_moves_its_subtree(self):
+        self.lighting.parent = self.garden
+        self.lighting.save()
+        self.assertPath(self.lighting, f'{self.garden.pk}/{self.lighting.pk}/', 1)
+        self.assertPath(self.bulbs, f'{self.garden.pk}/{self.lighting.pk}/{self.lamps.pk}/{self.bulbs.pk}/', 3)
+
+        self.lamps.parent = None
+        self.lamps.save(update_fields=['parent'])
+        self.assertPath(self.lamps, f'{self.lamps.pk}/', 0)
+        self.assertPath(self.bulbs, f'{self.lamps.pk}/{self.bulbs.pk}/', 1)
+        self.assertEqual(list(self.garden.get_descendants()), [self.lighting])
+        self.assertEqual(list(self.home.get_descendants()), [])
+
+    def test_rebuild_category_tree(self):
+        Category.objects.update(path='', depth=0)
+        out = StringIO()
+        call_command('rebuild_category_tree', '--batch-size', '2', stdout=out)
+        self.assertIn('Rebuilt paths for 5 categories', out.getvalue())
+        self.assertPath(self.bulbs, f'{self.home.pk}/{self.lighting.pk}/{self.lamps.pk}/{self.bulbs.pk}/', 3)
+        self.assertPath(self.garden, f'{self.garden.pk}/', 0)
+
+    def test_invalid_root(self):
+        for path in ('/api/shop/categories/tree/', '/api/shop/async/categories/tree/'):
+            self.assertEqual(self.client.get(f'{path}?root=abc').status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(self.client.get(f'{path}?root=999').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.home = Category.objects.create(name='Home', slug='home')
+        lamps = Category.objects.create(name='Lamps', slug='lamps', parent=self.home)
+        products = [
+            Product.objects.create(
+                category=(self.home, lamps)[i % 2], name=f'Item {i}', slug=f'item-{i}', description='An item',
+                price='5.00', stock=1
+            )
+            for i in range(7)
+        ]
+        # Bulk imports create many products in the same instant; ids must break the tie
+        Product.objects.filter(pk__in=[p.pk for p in products[1:6]]).update(created_at=products[0].created_at)
+        self.expected = list(Product.objects.order_by('-created_at', 'id').values_list('pk', flat=True))
+
+    def get_pages(self, path):
+        pages = []
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+            pages.append([product['id'] for product in response.data['results']])
+            path = response.data['next']
+        return pages
+
+    def test_tied_timestamps_page_without_gaps_or_repeats(self):
+        for page_size in (1, 2, 3):
+            pages = self.get_pages(f'/api/shop/products/?page_size={page_size}')
+            self.assertEqual([pk for page in pages for pk in page], self.expected, page_size)
+            self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+
+    def test_previous_link_returns_the_same_page(self):
+        first = self.client.get('/api/shop/products/?page_size=3')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual([p['id'] for p in back.data['results']], self.expected[:3])
+
+    def test_query_count_per_page_is_constant(self):
+        for query in ('', '&expand=category'):
+            counts = []
+            for page_size in (1, 2, 7):
+                path = f'/api/shop/products/?page_size={page_size}{query}'
+                while path:
+                    with CaptureQueriesContext(connection) as queries:
+                        path = self.client.get(path).data['next']
+                    counts.append(len(queries))
+            self.assertEqual(len(set(counts)), 1, (query, counts))
+
+
+class AsyncCatalogTests(APITestCase):
+    def setUp(self):
+        self.home = Category.objects.create(name='Home', slug='home')
+        self.lamps = Category.objects.create(name='Lamps', slug='lamps', parent=self.home)
+        self.garden = Category.objects.create(name='Garden', slug='garden')
+        self.products = [
+            Product.objects.create(
+                category=category, name=f'Item {i}', slug=f'item-{i}', description='An item', price=price,
+                stock=i % 2
+            )
+            for i, (category, price) in enumerate([
+                (self.home, '5.00'), (self.lamps, '30.00'), (self.lamps, '600.00'), (self.garden, '8.00'),
+                (self.garden, '12.00'),
+            ])
+        ]
+        # Tied timestamps must still page in a stable (-created_at, id) order
+        Product.objects.filter(pk__in=[p.pk for p in self.products[1:4]]).update(
+            created_at=self.products[0].created_at
+        )
+
+    async def get_ids(self, path):
+        ids = []
+        while path:
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+            page = response.json()
+            ids.extend(product['id'] for product in page['results'])
+            path = page['next']
+        return ids
+
+    async def test_list_pages_like_the_sync_list(self):
+        expected = [pk async for pk in Product.objects.order_by('-created_at', 'id').values_list('pk', flat=True)]
+        self.assertEqual(await self.get_ids('/api/shop/async/products/?page_size=2'), expected)
+        self.assertEqual(await self.get_ids('/api/shop/async/products/'), expected)
+
+    async def test_filters(self):
+        async def ids(query):
+            return set(await self.get_ids(f'/api/shop/async/products/?page_size=1&{query}'))
+
+        pks = [product.pk for product in self.products]
+        self.assertEqual(await ids('category=lamps'), {pks[1], pks[2]})
+        self.assertEqual(await ids('within=home'), {pks[0], pks[1], pks[2]})
+        self.assertEqual(await ids('within=home&price=500%2B'), {pks[2]})
+        self.assertEqual(await ids('in_stock=true'), {pks[1], pks[3]})
+
+    async def test_invalid_parameters(self):
+        for query in ('page_size=0', 'page_size=abc', 'cursor=abc', 'within=nowhere', 'price=1-2', 'in_stock=maybe'):
+            response = await self.async_client.get(f'/api/shop/async/products/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    async def test_detail(self):
+        product = self.products[1]
+        response = await self.async_client.get(f'/api/shop/async/products/{product.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.json()['slug'], response.json()['category']), ('item-1', self.lamps.pk))
+        response = await self.async_client.get('/api/shop/async/products/999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_tree_matches_sync_tree(self):
+        for query in ('', f'root={self.home.pk}', 'depth=0', f'root={self.home.pk}&depth=0'):
+            response = await self.async_client.get(f'/api/shop/async/categories/tree/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, query)
+            expected = await sync_to_async(self.client.get)(f'/api/shop/categories/tree/?{query}')
+            self.assertEqual(response.json(), expected.json(), query)
+        response = await self.async_client.get('/api/shop/async/categories/tree/?depth=-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CatalogCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Lamps', slug='lamps')
+        self.product = Product.objects.create(
+            category=self.category, name='Lamp', slug='lamp', description='', price='9.99', stock=1
+        )
+
+    def test_saves_invalidate_cached_reads(self):
+        path = f'/api/shop/products/{self.product.pk}/'
+        category_path = f'/api/shop/categories/{self.category.pk}/'
+        self.assertEqual(self.client.get(path)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(path)['X-Cache'], 'HIT')
+        self.client.get(category_path)
+
+        self.product.name = 'Desk lamp'
+        self.product.save()
+        response = self.client.get(path)
+        self.assertEqual((response['X-Cache'], response.data['name']), ('MISS', 'Desk lamp'))
+
+        self.category.name = 'Lighting'
+        self.category.save()
+        response = self.client.get(category_path)
+        self.assertEqual((response['X-Cache'], response.data['name']), ('MISS', 'Lighting'))
+        self.assertEqual(self.client.get(path)['X-Cache'], 'MISS')
+
+    def test_hit_and_miss_counters(self):
+        reset_cache_stats()
+        path = f'/api/shop/products/{self.product.pk}/'
+        for _ in range(3):
+            self.client.get(path)
+        self.assertEqual(get_cache_stats(), {'hits': 2, 'misses': 1})
+
+        out = StringIO()
+        call_command('catalog_cache_stats', '--reset', stdout=out)
+        self.assertIn('hits=2 misses=1 hit_ratio=66.67%', out.getvalue())
+        self.assertEqual(get_cache_stats(), {'hits': 0, 'misses': 0})
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        lamps = Category.objects.create(name='Lamps', slug='lamps')
+        desks = Category.objects.create(name='Desks', slug='desks')
+        for i in range(6):
+            Product.objects.create(
+                category=lamps if i % 3 == 0 else desks, name=f'Lamp {i}', slug=f'lamp-{i}', description='',
+                price='9.99', stock=1
+            )
+
+    def test_filters_apply_to_count_and_pages(self):
+        response = self.client.get('/api/shop/products/search/?q=lamp&category=lamps&page_size=1')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 1)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+
+class ProductImageTests(APITestCase):
+    def test_new_image_drops_previous_variants(self):
+        category = Category.objects.create(name='Lamps', slug='lamps')
+        product = Product.objects.create(
+            category=category, name='Lamp', slug='lamp', description='', price='9.99', stock=1,
+            image='products/old.png', image_variants={'webp': {'200': 'products/variants/1/200w-old.webp'}}
+        )
+        product = Product.objects.get(pk=product.pk)
+        product.image = 'products/new.png'
+        product.save(update_fields=['image'])
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, {})
+
+
+class FacetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.home = Category.objects.create(name='Home', slug='home')
+        self.garden = Category.objects.create(name='Garden', slug='garden')
+        self.lighting = Category.objects.create(name='Lighting', slug='lighting', parent=self.home)
+        self.lamps = Category.objects.create(name='Lamps', slug='lamps', parent=self.lighting)
+        self.products = {
+            slug: Product.objects.create(
+                category=category, name=slug.title(), slug=slug, description='', price=price, stock=stock
+            )
+            for slug, category, price, stock in (
+                ('bulb', self.lamps, '8.00', 0),
+                ('lamp', self.lighting, '30.00', 5),
+                ('hose', self.garden, '30.00', 2),
+                ('sofa', self.home, '600.00', 1),
+            )
+        }
+
+    def get(self, query):
+        response = self.client.get(f'/api/shop/products/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response
+
+    def slugs(self, query):
+        return sorted(product['slug'] for product in self.get(query).data['results'])
+
+    def facet_rows(self):
+        return sorted(ProductFacetCount.objects.filter(count__gt=0).values_list(
+            'category_id', 'price_bucket', 'is_available', 'in_stock', 'count'
+        ))
+
+    def test_filters_narrow_results(self):
+        self.assertEqual(self.slugs('within=home'), ['bulb', 'lamp', 'sofa'])
+        self.assertEqual(self.slugs('within=lighting'), ['bulb', 'lamp'])
+        self.assertEqual(self.slugs('category=lighting'), ['lamp'])
+        self.assertEqual(self.slugs('within=home&price=25-50'), ['lamp'])
+        self.assertEqual(self.slugs('price=0-10,500%2B'), ['bulb', 'sofa'])
+        self.assertEqual(self.slugs('in_stock=false'), ['bulb'])
+        self.assertEqual(self.slugs('within=home&in_stock=true&price=25-50,500%2B'), ['lamp', 'sofa'])
+        for query in ('price=5-6', 'within=nowhere', 'in_stock=maybe'):
+            self.assertEqual(self.client.get(f'/api/shop/products/?{query}').status_code, 400, query)
+
+    def test_counts_ignore_their_own_filter(self):
+        facets = self.get('within=home&in_stock=true&facets=true').data['facets']
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual([(row['slug'], row['count']) for row in facets['category']], [('lighting', 1)])
+        self.assertEqual({row['value']: row['count'] for row in facets['in_stock']}, {True: 2, False: 1})
+        self.assertEqual(
+            {row['value']: row['count'] for row in facets['price'] if row['count']}, {'25-50': 1, '500+': 1}
+        )
+
+    def test_counts_follow_product_changes(self):
+        Product.objects.create(
+            category=self.garden, name='Rake', slug='rake', description='', price='12.00', stock=3
+        )
+        lamp = Product.objects.get(slug='lamp')
+        lamp.price = '120.00'
+        lamp.stock = 0
+        lamp.save()
+        sofa = Product.objects.get(slug='sofa')
+        sofa.category = self.garden
+        sofa.save()
+        Product.objects.get(slug='bulb').delete()
+
+        live = self.facet_rows()
+        ProductFacetCount.refresh()
+        self.assertEqual(live, self.facet_rows())
+        facets = self.get('facets=true').data['facets']
+        self.assertEqual(facets['total'], 4)
+        self.assertEqual(
+            {row['value']: row['count'] for row in facets['price'] if row['count']},
+            {'10-25': 1, '25-50': 1, '100-250': 1, '500+': 1},
+        )
+        self.assertEqual({row['value']: row['count'] for row in facets['in_stock']}, {True: 3, False: 1})
+        self.assertEqual(
+            [(row['slug'], row['count']) for row in facets['category']], [('garden', 3), ('home', 1)]
+        )
+
+
+class ShapingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='secret-pass')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Lamps', slug='lamps')
+        self.product = Product.objects.create(
+            category=self.category, name='Lamp', slug='lamp', description='Brass', price='9.99', stock=3
+        )
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+
+    def get_product(self, query=''):
+        return self.client.get(f'/api/shop/products/{self.product.pk}/?{query}').data
+
+    def get_cart_item(self, query=''):
+        return self.client.get(f'/api/shop/cart/{self.cart.pk}/?{query}').data['items'][0]
+
+    def test_relations_collapse_to_primary_keys(self):
+        self.assertEqual(self.get_product()['category'], self.category.pk)
+        self.assertEqual(self.get_cart_item()['product'], self.product.pk)
+
+    def test_expand(self):
+        self.assertEqual(self.get_product('expand=category')['category']['name'], 'Lamps')
+        item = self.get_cart_item('expand=items.product')
+        self.assertEqual((item['product']['name'], item['product']['category']), ('Lamp', self.category.pk))
+        item = self.get_cart_item('expand=items.product.category')
+        self.assertEqual(item['product']['category']['slug'], 'lamps')
+
+    def test_sparse_fields(self):
+        self.assertEqual(self.get_product('fields=id,name'), {'id': self.product.pk, 'name': 'Lamp'})
+        # Naming nested fields implies the expansion
+        self.assertEqual(
+            self.get_product('fields=id,category.name'), {'id': self.product.pk, 'category': {'name': 'Lamps'}}
+        )
+        self.assertEqual(self.get_cart_item('fields=items.quantity'), {'quantity': 2})
+
+    def test_unknown_names_are_ignored(self):
+        self.assertEqual(self.get_product('fields=id,colour'), {'id': self.product.pk})
+        self.assertEqual(self.get_product('expand=colour')['category'], self.category.pk)
+        self.assertEqual(self.get_cart_item('expand=items.colour')['product'], self.product.pk)
+
+    def test_unexpanded_shapes_do_not_join(self):
+        for query, joins in (('', False), ('expand=category', True), ('fields=id,name', False)):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f'/api/shop/products/?{query}')
+            product_queries = [q['sql'] for q in queries if 'FROM "shop_product"' in q['sql']]
+            self.assertEqual(len(product_queries), 1, query)
+            self.assertEqual('JOIN "shop_category"' in product_queries[0], joins, query)
+        self.assertNotIn('"description"', product_queries[0])
+
+        for query, joins in (('', False), ('expand=items.product', True)):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f'/api/shop/cart/?{query}')
+            item_queries = [q['sql'] for q in queries if 'FROM "shop_cartitem"' in q['sql']]
+            self.assertEqual(len(item_queries), 1, query)
+            self.assertEqual('JOIN "shop_product"' in item_queries[0], joins, query)
+
+
+class ProductImportExportTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='secret-pass'))
+        self.lamps = Category.objects.create(name='Lamps', slug='lamps')
+        self.desks = Category.objects.create(name='Desks', slug='desks')
+        Product.objects.create(
+            category=self.lamps, name='Old lamp', slug='lamp', description='Brass', price='5.00', stock=1
+        )
+
+    def upload(self, name, content):
+        return self.client.post(
+            '/api/shop/products/import/', {'file': SimpleUploadedFile(name, content.encode())}, format='multipart'
+        )
+
+    def export(self, fmt):
+        response = self.client.get(f'/api/shop/products/export/?file_format={fmt}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_upserts_by_slug_and_reports_bad_rows(self):
+        response = self.upload('products.csv', (
+            'slug,category,name,description,price,stock,is_available\n'
+            'lamp,desks,Desk lamp,Bright,12.50,4,yes\n'
+            'chair,desks,Chair,Oak,30.00,,\n'
+            'chair,desks,Chair again,Oak,31.00,1,\n'
+            'vase,lamps,Vase,Glass,not-a-price,1,\n'
+            'rug,floors,Rug,Wool,10.00,1,\n'
+        ))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assertEqual([error['line'] for error in response.data['errors']], [4, 5, 6])
+        self.assertIn('duplicate slug', response.data['errors'][0]['error'])
+        self.assertIn('price', response.data['errors'][1]['error'])
+        self.assertIn('unknown category', response.data['errors'][2]['error'])
+
+        lamp = Product.objects.get(slug='lamp')
+        self.assertEqual((lamp.category, lamp.name, str(lamp.price), lamp.stock), (self.desks, 'Desk lamp', '12.50', 4))
+        chair = Product.objects.get(slug='chair')
+        self.assertEqual((chair.stock, chair.is_available), (0, True))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_jsonl_export_round_trips(self):
+        self.upload(
+            'products.jsonl',
+            '{"slug": "desk", "category": "desks", "name": "Desk", "description": "Walnut", "price": "80.00"}\n'
+        )
+        exported = self.export('jsonl')
+        self.assertEqual(len(exported.splitlines()), 2)
+        Product.objects.all().delete()
+
+        response = self.upload('products.jsonl', exported)
+        self.assertEqual((response.data['created'], response.data['errors']), (2, []))
+        self.assertEqual(self.export('jsonl'), exported)
+
+    def test_csv_export_round_trips(self):
+        exported = self.export('csv')
+        self.assertEqual(exported.splitlines()[0], 'slug,category,name,description,price,stock,is_available,image')
+        Product.objects.update(name='Renamed')
+        response = self.upload('products.csv', exported)
+        self.assertEqual((response.data['updated'], response.data['errors']), (1, []))
+        self.assertEqual(self.export('csv'), exported)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(User.objects.create_user(username='buyer', password='secret-pass'))
+        self.assertEqual(self.upload('products.csv', 'slug\n').status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get('/api/shop/products/export/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BulkOrderStatusTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='warehouse', password='secret-pass')
+        self.client.force_authenticate(self.admin)
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            category=category, name='Book', slug='book', description='', price='2.50', stock=4
+        )
+        self.orders = []
+        for order_status in ('processing', 'processing', 'shipped', 'pending'):
+            order = Order.objects.create(user=self.admin, status=order_status, total_amount='5.00')
+            OrderItem.objects.create(order=order, product=self.product, quantity=2, price='2.50')
+            self.orders.append(order)
+        self.product.stock = 0
+        self.product.save()
+        record_order_status(Order.objects.all())
+        record_order_sales(Order.objects.all())
+
+    def post(self, order_ids, order_status):
+        return self.client.post(
+            '/api/shop/orders/bulk-status/', {'order_ids': order_ids, 'status': order_status}, format='json'
+        )
+
+    def status_counts(self):
+        return dict(DailyOrderStatusCount.objects.filter(orders__gt=0).values_list('status', 'orders'))
+
+    def test_ship_reports_each_order(self):
+        ids = [order.pk for order in self.orders]
+        response = self.post(ids + [999], 'shipped')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(
+            [result['result'] for result in response.data['results']],
+            ['updated', 'updated', 'unchanged', 'error', 'error'],
+        )
+        self.assertEqual(self.status_counts(), {'shipped': 3, 'pending': 1})
+
+    def test_cancel_restocks_and_updates_rollups(self):
+        response = self.post([self.orders[0].pk, self.orders[3].pk, self.orders[2].pk], 'cancelled')
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(response.data['results'][2]['result'], 'error')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 4)
+        self.assertEqual(DailyProductSales.objects.get().units, 4)
+        self.assertEqual(self.status_counts(), {'processing': 1, 'shipped': 1, 'cancelled': 2})
+        self.assertEqual(ProductFacetCount.objects.get(in_stock=True).count, 1)
+
+    def test_backfill_rebuilds_the_live_rollups(self):
+        self.post([self.orders[0].pk, self.orders[3].pk], 'cancelled')
+        live = self.status_counts()
+        DailyOrderStatusCount.objects.update(orders=0)
+        call_command('backfill_sales_rollups', '--chunk-size', '1', stdout=StringIO())
+        self.assertEqual(self.status_counts(), live)
+        self.assertEqual(DailyProductSales.objects.get().units, 4)
+
+    def test_top_sellers(self):
+        response = self.client.get('/api/shop/reports/top_sellers/?days=1&limit=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['product_id'], row['units_sold']) for row in response.data], [(self.product.pk, 8)])
+        for query in ('days=0', 'days=-3', 'limit=0', 'limit=-1', 'limit=ten'):
+            response = self.client.get(f'/api/shop/reports/top_sellers/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(User.objects.create_user(username='buyer', password='secret-pass'))
+        self.assertEqual(self.post([self.orders[0].pk], 'shipped').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class OrderHistoryTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='secret-pass')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Lamps', slug='lamps')
+        self.products = [
+            Product.objects.create(
+                category=category, name=f'Lamp {i}', slug=f'lamp-{i}', description='A lamp', price='10.00', stock=10
+            )
+            for i in range(3)
+        ]
+        other = User.objects.create_user(username='other', password='secret-pass')
+        self.add_order(other, [(self.products[0], 1)])
+
+    def add_order(self, user, lines):
+        order = Order.objects.create(user=user, total_amount='10.00')
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price)
+        return order
+
+    def list_ids(self, path):
+        ids = []
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+            ids.extend(order['id'] for order in response.data['results'])
+            path = response.data['next']
+        return ids
+
+    def test_summary_fields(self):
+        order = self.add_order(self.user, [(self.products[2], 2), (self.products[0], 3)])
+        empty = self.add_order(self.user, [])
+        results = {row['id']: row for row in self.client.get('/api/shop/orders/').data['results']}
+        self.assertEqual(set(results), {order.pk, empty.pk})
+        self.assertEqual((results[order.pk]['item_count'], results[order.pk]['first_item_name']), (5, 'Lamp 2'))
+        self.assertEqual((results[empty.pk]['item_count'], results[empty.pk]['first_item_name']), (0, None))
+        self.assertNotIn('items', results[order.pk])
+
+    def test_cursor_paging(self):
+        orders = [self.add_order(self.user, [(self.products[0], 1)]) for _ in range(5)]
+        # Orders placed in the same instant still page in a stable (-created_at, id) order
+        Order.objects.filter(pk__in=[order.pk for order in orders[:3]]).update(created_at=orders[0].created_at)
+        expected = list(
+            Order.objects.filter(user=self.user).order_by('-created_at', 'id').values_list('pk', flat=True)
+        )
+        self.assertEqual(self.list_ids('/api/shop/orders/?page_size=2'), expected)
+        self.assertEqual(self.list_ids('/api/shop/orders/'), expected)
+
+    def test_query_count_does_not_grow_with_orders(self):
+        self.add_order(self.user, [(self.products[0], 1)])
+        with CaptureQueriesContext(connection) as one:
+            self.client.get('/api/shop/orders/')
+        for _ in range(5):
+            self.add_order(self.user, [(product, 2) for product in self.products])
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get('/api/shop/orders/')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(len(many), len(one))
+
+
+class QueryPlanTests(APITestCase):
+    """Hot endpoints must not fall back to full table scans."""
+    # CategoryIndex deliberately snapshots the whole (small) category table
+    ALLOWED_SCANS = {'shop_category'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='secret-pass')
+        self.client.force_authenticate(self.user)
+        root = Category.objects.create(name='Home', slug='home')
+        self.leaf = Category.objects.create(name='Lamps', slug='lamps', parent=root)
+        self.products = [
+            Product.objects.create(
+                category=self.leaf, name=f'Lamp {i}', slug=f'lamp-{i}', description='', price='9.99', stock=10
+            )
+            for i in range(3)
+        ]
+        Address.objects.create(
+            user=self.user, street_address='1 Main St', city='Town', state='State', country='Country',
+            postal_code='12345', is_default=True
+        )
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=1)
+        self.order_id = self.client.post('/api/shop/orders/', {}, format='json').data['id']
+        self.cart = Cart.objects.create(user=self.user)
+
+    def assertNoFullScans(self, method, path, data=None):
+        with capture_query_plans() as plans:
+            response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 400, path)
+        for sql, plan in plans:
+            scanned = set(full_scans(plan)) - self.ALLOWED_SCANS
+            self.assertFalse(scanned, f'{method.upper()} {path} scans {scanned}:\n{sql}\n{plan}')
+
+    def test_catalog(self):
+        self.assertNoFullScans('get', '/api/shop/products/')
+        self.assertNoFullScans('get', '/api/shop/products/?category=lamps&is_available=true')
+        self.assertNoFullScans('get', '/api/shop/products/?within=home')
+        self.assertNoFullScans('get', f'/api/shop/products/{self.products[0].pk}/')
+        self.assertNoFullScans('get', self.client.get('/api/shop/products/?page_size=1').data['next'])
+
+    def test_cart(self):
+        self.assertNoFullScans('get', '/api/shop/cart/')
+        self.assertNoFullScans('post', f'/api/shop/cart/{self.cart.pk}/add_item/', {'product_id': self.products[1].pk})
+
+    def test_orders(self):
+        self.assertNoFullScans('get', '/api/shop/orders/')
+        self.assertNoFullScans('get', f'/api/shop/orders/{self.order_id}/')
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1)
+        self.assertNoFullScans('post', '/api/shop/orders/', {})
+
+    def test_addresses(self):
+        self.assertNoFullScans('get', '/api/users/addresses/')
+
+
+class FastRenderingTests(APITestCase):
+    """The fast serializers and renderer must produce the same bytes as DRF's generic path."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='secret-pass')
+        self.client.force_authenticate(self.user)
+        root = Category.objects.create(name='Home', slug='home')
+        leaf = Category.objects.create(name='Lamps \u2028 & Lights', slug='lamps', parent=root)
+        self.products = [
+            Product.objects.create(
+                category=root, name='Plain lamp', slug='plain-lamp', description='No image', price='0.10', stock=0
+            ),
+            Product.objects.create(
+                category=leaf, name='Lampe d\u2019\u00e9t\u00e9', slug='summer-lamp', description='With image',
+                price='1234.50', stock=3, image='products/lamp.png',
+                image_variants={'webp': {'200': 'products/variants/2/200w-lamp.webp'}}
+            ),
+        ]
+        cart = Cart.objects.create(user=self.user)
+        for product in self.products:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        # No shipping address: a null relation in the order output
+        self.order = Order.objects.create(user=self.user, total_amount='2469.20')
+        OrderItem.objects.create(order=self.order, product=self.products[1], quantity=2, price='1234.50')
+
+    def assertSameOutput(self, path):
+        responses = {}
+        for fast in (False, True):
+            cache.clear()
+            with override_settings(SHOP_FAST_SERIALIZERS=fast):
+                responses[fast] = self.client.get(path)
+            self.assertEqual(responses[fast].status_code, status.HTTP_200_OK, path)
+        self.assertEqual(responses[True].content, responses[False].content, path)
+        self.assertEqual(responses[True].content, JSONRenderer().render(responses[False].data), path)
+        return json.loads(responses[True].content)
+
+    def test_products(self):
+        results = self.assertSameOutput('/api/shop/products/?expand=category')['results']
+        self.assertEqual(
+            results[0]['image_srcset'], {'webp': 'http://testserver/media/products/variants/2/200w-lamp.webp 200w'}
+        )
+        self.assertIsNone(results[1]['category']['parent'])
+        self.assertEqual(results[1]['image'], None)
+
+    def test_cart_and_order(self):
+        self.assertSameOutput('/api/shop/cart/?expand=product')
+        order = self.assertSameOutput(f'/api/shop/orders/{self.order.pk}/')
+        self.assertIsNone(order['shipping_address'])
+        self.assertTrue(order['created_at'].endswith('Z'))
+
+    def test_renderer_matches_stock_json(self):
+        data = {
+            'price': Decimal('9.99'), 'when': timezone.now(), 'day': timezone.now().date(), 'none': None,
+            'text': 'line\u2028break \u00e9', 1: [1.5, True],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_non_finite_floats(self):
+        # Strict (the default) renders null where DRF raises, as documented on FastJSONRenderer
+        self.assertEqual(FastJSONRenderer().render({'x': float('nan')}), b'{"x":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({'x': float('nan')})
+        fast, stock = FastJSONRenderer(), JSONRenderer()
+        fast.strict = stock.strict = False
+        self.assertEqual(fast.render({'x': float('inf')}), b'{"x":Infinity}')
+        self.assertEqual(fast.render({'x': float('inf')}), stock.render({'x': float('inf')}))
+
+
+class MetricsTests(APITestCase):
+    def test_metrics_are_not_public(self):
+        self.client.get('/api/shop/categories/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'category-list', response.content)
+
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(User.objects.create_user(username='ops', password='secret-pass', is_staff=True))
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, status.HTTP_200_OK)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+    router = PrimaryReplicaRouter()
+
+    def route(self, method, cookies=None, write=False):
+        """Run a request through the pinning middleware and return where a product read went."""
+        reads = []
+
+        def view(request):
+            if write:
+                self.router.db_for_write(Cart)
+            reads.append(self.router.db_for_read(Product))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method.lower())('/')
+        request.COOKIES.update(cookies or {})
+        response = copy_context().run(ReplicaPinningMiddleware(view), request)
+        return reads[0], response
+
+    def test_catalog_reads_use_replica(self):
+        self.assertEqual(self.route('GET')[0], 'replica')
+
+    def test_cart_and_order_reads_stay_on_primary(self):
+        self.assertEqual(self.router.db_for_read(Cart), 'default')
+        self.assertEqual(self.router.db_for_read(Order), 'default')
+
+    def test_writes_pin_request_and_client_to_primary(self):
+        alias, response = self.route('GET', write=True)
+        self.assertEqual(alias, 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.route('GET', cookies={PIN_COOKIE: '1'})[0], 'default')
+
+    def test_unsafe_methods_read_from_primary(self):
+        self.assertEqual(self.route('POST')[0], 'default')
+
+    def test_async_stack_shares_state_with_sync_orm_calls(self):
+        reads = []
+
+        def write_then_read():
+            self.router.db_for_write(Cart)
+            reads.append(self.router.db_for_read(Product))
+
+        async def view(request):
+            reads.append(self.router.db_for_read(Product))
+            await sync_to_async(write_then_read)()
+            return HttpResponse()
+
+        response = async_to_sync(ReplicaPinningMiddleware(view))(RequestFactory().get('/'))
+        self.assertEqual(reads, ['replica', 'default'])
+        self.assertIn(PIN_COOKIE, response.cookies)
@@ -1,13 +1,18 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet, CartViewSet, OrderViewSet
+from .views import CategoryViewSet, ProductViewSet, CartViewSet, OrderViewSet, ReportViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet)
 router.register(r'products', ProductViewSet)
 router.register(r'cart', CartViewSet, basename='cart')
 router.register(r'orders', OrderViewSet, basename='order')
+router.register(r'reports', ReportViewSet, basename='report')
 
 urlpatterns = [
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/categories/tree/', async_views.category_tree, name='async-category-tree'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
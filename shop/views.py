@@ -1,21 +1,90 @@
+from datetime import date, timedelta
+
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .models import Category, Product, Cart, CartItem, Order, OrderItem
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from .models import (
+    Category, Product, Cart, CartItem, Order, OrderItem, ProductFacetCount,
+    DailyProductSales, DailyCategorySales, DailyOrderStatusCount, record_order_sales, record_order_status
+)
 from .serializers import (
     CategorySerializer, ProductSerializer, CartSerializer,
-    CartItemSerializer, OrderSerializer
+    CartItemSerializer, OrderSerializer, CategoryIndex, build_category_tree,
+    BulkCartItemSerializer, BulkOrderStatusSerializer, OrderSummarySerializer, parse_shape
 )
+from .pagination import OrderCursorPagination, ProductCursorPagination, SearchPagination
+from .search import SearchResults
+from .facets import FacetFilter
+from .fulfillment import transition_orders
+from .importing import export_products, import_products
+from .cache import bump_catalog_version, cached_catalog_response
+from .idempotency import idempotent
+from core.importing import open_upload, read_rows
 from users.models import UserProfile
+from users.authentication import CachedJWTAuthentication, StatelessReadJWTAuthentication
 
 # Create your views here.
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CheckoutError(Exception):
+    def __init__(self, detail, status_code):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+class ShapedViewMixin:
+    """Shape responses with ?fields= and ?expand=, e.g. ?fields=id,name,category.name&expand=category."""
+
+    def get_shape(self):
+        if not hasattr(self, '_shape'):
+            params = self.request.query_params
+            self._shape = {
+                'fields': parse_shape(params.get('fields')),
+                'expand': parse_shape(params.get('expand')) or {},
+            }
+        return self._shape
+
+    def is_expanded(self, path):
+        """Whether every relation on a dotted path like "items.product" is rendered in full."""
+        fields, expand = self.get_shape()['fields'], self.get_shape()['expand']
+        for name in path.split('.'):
+            if name not in expand and not (fields and fields.get(name)):
+                return False
+            fields, expand = (fields.get(name) or None) if fields else None, expand.get(name) or {}
+        return True
+
+    def is_requested(self, name):
+        fields = self.get_shape()['fields']
+        return fields is None or name in fields
+
+    def get_serializer(self, *args, **kwargs):
+        for key, value in self.get_shape().items():
+            kwargs.setdefault(key, value)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_item_prefetch(self, model):
+        """Prefetch of order or cart lines, joining only the product data that will be rendered."""
+        queryset = model.objects.all()
+        if self.is_expanded('items.product'):
+            queryset = queryset.select_related(
+                'product__category' if self.is_expanded('items.product.category') else 'product'
+            )
+        return Prefetch('items', queryset=queryset)
+
+class CategoryViewSet(ShapedViewMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # Catalog reads never need the user row
+    authentication_classes = [StatelessReadJWTAuthentication]
 
     def get_queryset(self):
         queryset = Category.objects.all()
@@ -28,7 +97,56 @@ class CategoryViewSet(viewsets.ModelViewSet):
             
         return queryset
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'subcategories'):
+            context['category_index'] = CategoryIndex()
+        return context
+
+    @cached_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    @cached_catalog_response
+    def tree(self, request):
+        queryset = Category.objects.order_by('depth', '-created_at')
+        root = request.query_params.get('root')
+        depth = request.query_params.get('depth')
+
+        base_depth = 0
+        if root is not None:
+            try:
+                root = int(root)
+            except ValueError:
+                return Response(
+                    {"error": "root must be an integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            root_category = get_object_or_404(Category, pk=root)
+            queryset = queryset.filter(root_category.subtree_q())
+            base_depth = root_category.depth
+        if depth is not None:
+            try:
+                depth = int(depth)
+                if depth < 0:
+                    raise ValueError
+            except ValueError:
+                return Response(
+                    {"error": "depth must be a non-negative integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            queryset = queryset.filter(depth__lte=base_depth + depth)
+
+        rows = queryset.values('id', 'name', 'slug', 'parent', 'depth')
+        return Response(build_category_tree(rows))
+
     @action(detail=True, methods=['get'])
+    @cached_catalog_response
     def subcategories(self, request, pk=None):
         category = self.get_object()
         subcategories = category.subcategories.all()
@@ -36,100 +154,350 @@ class CategoryViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
+    @cached_catalog_response
     def products(self, request, pk=None):
         category = self.get_object()
         # Get all products in this category and its subcategories
-        category_ids = [category.id] + [c.id for c in category.get_descendants()]
-        products = Product.objects.filter(category_id__in=category_ids)
-        serializer = ProductSerializer(products, many=True)
+        products = Product.objects.filter(category.subtree_q(prefix='category__'))
+        if self.is_expanded('category'):
+            products = products.select_related('category')
+        serializer = ProductSerializer(products, many=True, context={
+            **self.get_serializer_context(), 'category_index': CategoryIndex()
+        }, **self.get_shape())
         return Response(serializer.data)
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ShapedViewMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    authentication_classes = [StatelessReadJWTAuthentication]
+    pagination_class = ProductCursorPagination
 
     def get_queryset(self):
         queryset = Product.objects.all()
-        category = self.request.query_params.get('category', None)
-        if category is not None:
-            queryset = queryset.filter(category__slug=category)
-        return queryset
+        if self.is_expanded('category'):
+            queryset = queryset.select_related('category')
+        fields = self.get_shape()['fields']
+        if fields is not None and self.request.method in permissions.SAFE_METHODS:
+            # Load only the columns the requested fields read, plus the pagination ordering
+            model_fields = {field.name for field in Product._meta.concrete_fields}
+            columns = {'id', 'created_at'}
+            for name in fields:
+                columns.update(ProductSerializer.field_columns.get(name, (name,)))
+            queryset = queryset.only(*(columns & model_fields))
+        return self.get_facet_filter().filter_queryset(queryset)
+
+    def get_facet_filter(self):
+        if not hasattr(self, '_facet_filter'):
+            self._facet_filter = FacetFilter(self.request.query_params)
+        return self._facet_filter
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # Nested category data is resolved from one shared snapshot instead of per-row queries
+        context['category_index'] = CategoryIndex()
+        return context
+
+    @cached_catalog_response
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets', '').lower() in ('true', '1'):
+            response.data['facets'] = self.get_facet_filter().counts()
+        return response
 
-class CartViewSet(viewsets.ModelViewSet):
+    @cached_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    @cached_catalog_response
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"error": "q is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(SearchResults(query, self.get_queryset()), request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False, methods=['post'], url_path='import',
+        permission_classes=[permissions.IsAdminUser], parser_classes=[MultiPartParser]
+    )
+    def bulk_import(self, request):
+        try:
+            stream, fmt = open_upload(request)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(import_products(read_rows(stream, fmt)), status=status.HTTP_200_OK)
+
+    @action(
+        detail=False, methods=['get'],
+        permission_classes=[permissions.IsAdminUser], authentication_classes=[CachedJWTAuthentication]
+    )
+    def export(self, request):
+        # "format" is taken by DRF's renderer negotiation
+        fmt = request.query_params.get('file_format', 'csv')
+        if fmt not in ('csv', 'jsonl'):
+            return Response({"error": "file_format must be csv or jsonl"}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            export_products(self.get_queryset(), fmt),
+            content_type='text/csv' if fmt == 'csv' else 'application/jsonl',
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+        return response
+
+class CartViewSet(ShapedViewMixin, viewsets.ModelViewSet):
     serializer_class = CartSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user, is_active=True)
+        queryset = Cart.objects.filter(user=self.request.user, is_active=True)
+        if self.action in ('list', 'retrieve') and self.is_requested('items'):
+            queryset = queryset.prefetch_related(self.get_item_prefetch(CartItem))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['category_index'] = CategoryIndex()
+        return context
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def add_item(self, request, pk=None):
         cart = self.get_object()
         product_id = request.data.get('product_id')
-        quantity = request.data.get('quantity', 1)
+        try:
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "quantity must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
         product = get_object_or_404(Product, id=product_id)
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += int(quantity)
-            cart_item.save()
 
-        serializer = CartItemSerializer(cart_item)
+        with transaction.atomic():
+            cart.apply_item_changes({product.pk: ('add', quantity)})
+
+        # Shaped like one line of the cart, so ?expand=product renders the product in full
+        cart_item = CartItem.objects.filter(cart=cart, product=product)
+        if self.is_expanded('product'):
+            cart_item = cart_item.select_related('product__category' if self.is_expanded('product.category') else 'product')
+        cart_item = cart_item.first()
+        if cart_item is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        serializer = CartItemSerializer(cart_item, context=self.get_serializer_context(), **self.get_shape())
         return Response(serializer.data)
 
+    @action(detail=True, methods=['post'])
+    def bulk_update_items(self, request, pk=None):
+        cart = self.get_object()
+        serializer = BulkCartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            cart.apply_item_changes(serializer.get_changes())
+
+        cart = self.get_queryset().prefetch_related(self.get_item_prefetch(CartItem)).get(pk=cart.pk)
+        return Response(self.get_serializer(cart).data)
+
     @action(detail=True, methods=['post'])
     def remove_item(self, request, pk=None):
         cart = self.get_object()
         product_id = request.data.get('product_id')
-        
-        cart_item = get_object_or_404(CartItem, cart=cart, product_id=product_id)
-        cart_item.delete()
-        
+
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "product_id must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Totals are recomputed from the remaining lines, so a concurrent change to this line cannot skew them
+        with transaction.atomic():
+            deleted, _ = CartItem.objects.filter(cart=cart, product_id=product_id).delete()
+            if not deleted:
+                return Response({"error": "Item not in cart"}, status=status.HTTP_404_NOT_FOUND)
+            Cart.objects.filter(pk=cart.pk).update(**Cart.line_totals())
+
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ShapedViewMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderCursorPagination
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        queryset = Order.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by()
+            if self.is_requested('item_count'):
+                queryset = queryset.annotate(item_count=Coalesce(Subquery(
+                    lines.values('order').annotate(units=Sum('quantity')).values('units')
+                ), 0))
+            if self.is_requested('first_item_name'):
+                queryset = queryset.annotate(
+                    first_item_name=Subquery(lines.order_by('id').values('product__name')[:1])
+                )
+        elif self.action == 'retrieve' and self.is_requested('items'):
+            queryset = queryset.prefetch_related(self.get_item_prefetch(OrderItem))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderSummarySerializer
+        return OrderSerializer
 
+    @idempotent
     def create(self, request):
         cart = get_object_or_404(Cart, user=request.user, is_active=True)
-        cart_items = cart.items.all()
-        
-        if not cart_items.exists():
-            return Response(
-                {"error": "Cart is empty"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
 
-        # Create order
+        shipping_address = None
+        address_id = request.data.get('shipping_address')
+        if address_id is not None:
+            shipping_address = request.user.addresses.filter(pk=address_id).first()
+            if shipping_address is None:
+                return Response(
+                    {"error": "Invalid shipping address"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        try:
+            with transaction.atomic():
+                order = self._checkout(cart, shipping_address)
+        except CheckoutError as exc:
+            return Response(exc.detail, status=exc.status_code)
+
+        order = self.get_queryset().prefetch_related(self.get_item_prefetch(OrderItem)).get(pk=order.pk)
+        serializer = self.get_serializer(order)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['category_index'] = CategoryIndex()
+        return context
+
+    @action(
+        detail=False, methods=['post'], url_path='bulk-status', permission_classes=[permissions.IsAdminUser]
+    )
+    def bulk_status(self, request):
+        serializer = BulkOrderStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = transition_orders(serializer.validated_data['order_ids'], serializer.validated_data['status'])
+        return Response({
+            'updated': sum(result['result'] == 'updated' for result in results),
+            'results': results,
+        })
+
+    def _checkout(self, cart, shipping_address):
+        # Claim the cart first so a concurrent checkout of the same cart cannot create a second order
+        if not Cart.objects.filter(pk=cart.pk, is_active=True).update(is_active=False):
+            raise CheckoutError({"error": "Cart has already been checked out"}, status.HTTP_409_CONFLICT)
+
+        lines = list(cart.items.select_related('product'))
+        if not lines:
+            raise CheckoutError({"error": "Cart is empty"}, status.HTTP_400_BAD_REQUEST)
+
+        quantities = {}
+        for line in lines:
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+
+        # One conditional UPDATE: only rows that still have enough stock are decremented
+        enough_stock = Q()
+        for product_id, quantity in quantities.items():
+            enough_stock |= Q(pk=product_id, stock__gte=quantity)
+        updated = Product.objects.filter(enough_stock).update(stock=F('stock') - Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=models.PositiveIntegerField()
+        ))
+        if updated != len(quantities):
+            # Stock as loaded with the lines, before the UPDATE decremented the products that had enough
+            stock = {line.product_id: line.product.stock for line in lines}
+            raise CheckoutError({
+                "error": "Insufficient stock",
+                "products": [pk for pk, quantity in quantities.items() if stock.get(pk, 0) < quantity],
+            }, status.HTTP_409_CONFLICT)
+        ProductFacetCount.record_sold_out(quantities)
+        # Cached product responses include stock
+        bump_catalog_version()
+
         order = Order.objects.create(
-            user=request.user,
-            total_amount=sum(item.product.price * item.quantity for item in cart_items),
-            shipping_address=request.data.get('shipping_address')
+            user_id=cart.user_id,
+            total_amount=sum(line.product.price * line.quantity for line in lines),
+            shipping_address=shipping_address
         )
-
-        # Create order items
-        for cart_item in cart_items:
-            OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
+                product=line.product,
+                quantity=line.quantity,
+                price=line.product.price
             )
+            for line in lines
+        ])
 
-        # Deactivate cart
-        cart.is_active = False
-        cart.save()
+        placed = Order.objects.filter(pk=order.pk)
+        record_order_sales(placed)
+        record_order_status(placed)
+        return order
 
-        serializer = self.get_serializer(order)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+class ReportViewSet(viewsets.ViewSet):
+    """Sales reports read exclusively from the daily rollup tables."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def _date_range(self, request):
+        try:
+            end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params else timezone.localdate()
+            start = (
+                date.fromisoformat(request.query_params['start']) if 'start' in request.query_params
+                else end - timedelta(days=29)
+            )
+        except ValueError:
+            raise ValidationError({'detail': 'start and end must be ISO dates (YYYY-MM-DD).'})
+        return start, end
+
+    @action(detail=False, methods=['get'])
+    def revenue(self, request):
+        start, end = self._date_range(request)
+        if request.query_params.get('group') == 'product':
+            rows = DailyProductSales.objects.filter(date__range=(start, end)).values(
+                'date', 'product_id', 'product__name', 'units', 'revenue'
+            ).order_by('date', 'product_id')
+        else:
+            rows = DailyCategorySales.objects.filter(date__range=(start, end))
+            within = request.query_params.get('within')
+            if within:
+                category = get_object_or_404(Category, slug=within)
+                rows = rows.filter(category.subtree_q(prefix='category__'))
+            rows = rows.values('date', 'category_id', 'category__name', 'units', 'revenue').order_by('date', 'category_id')
+        return Response(list(rows))
+
+    @action(detail=False, methods=['get'])
+    def top_sellers(self, request):
+        try:
+            days = int(request.query_params.get('days', 7))
+            limit = min(int(request.query_params.get('limit', 10)), 100)
+        except ValueError:
+            raise ValidationError({'detail': 'days and limit must be integers.'})
+        if days < 1 or limit < 1:
+            raise ValidationError({'detail': 'days and limit must be positive.'})
+        since = timezone.localdate() - timedelta(days=days - 1)
+        rows = DailyProductSales.objects.filter(date__gte=since).values('product_id', 'product__name').annotate(
+            units_sold=Sum('units'), revenue_total=Sum('revenue')
+        ).order_by('-units_sold', 'product_id')[:limit]
+        return Response(list(rows))
+
+    @action(detail=False, methods=['get'])
+    def order_status(self, request):
+        start, end = self._date_range(request)
+        rows = DailyOrderStatusCount.objects.filter(date__range=(start, end), orders__gt=0).values(
+            'date', 'status', 'orders'
+        ).order_by('date', 'status')
+        return Response(list(rows))
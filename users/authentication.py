@@ -0,0 +1,65 @@
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import permissions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import cache_timeout, cached_user_key
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves users (with their profile) from a short-TTL cache.
+
+    Entries are keyed by user id and a per-user version that is bumped whenever the
+    user or profile is saved, so password changes and deactivation take effect at once.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = cached_user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = self.user_model.objects.select_related('profile').get(
+                    **{api_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache.set(key, user, cache_timeout())
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
+
+
+class StatelessReadJWTAuthentication(CachedJWTAuthentication):
+    """Opt-in: trust the token claims on safe methods instead of loading the user.
+
+    Read-only requests get a TokenUser built from the token alone; unsafe methods
+    still resolve the real user. Only use it on views that never read user fields
+    beyond the id.
+    """
+
+    def authenticate(self, request):
+        self._safe_request = request.method in permissions.SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if getattr(self, '_safe_request', False):
+            if api_settings.USER_ID_CLAIM not in validated_token:
+                raise InvalidToken(_("Token contained no recognizable user identification"))
+            return api_settings.TOKEN_USER_CLASS(validated_token)
+        return super().get_user(validated_token)
@@ -0,0 +1,23 @@
+from django.conf import settings
+
+from core.cache import bump_version, get_version
+
+
+def _version_key(user_id):
+    return f'users:auth:version:{user_id}'
+
+
+def get_auth_version(user_id):
+    return get_version(_version_key(user_id))
+
+
+def invalidate_cached_user(user_id):
+    bump_version(_version_key(user_id))
+
+
+def cached_user_key(user_id):
+    return f'users:auth:user:{user_id}:{get_auth_version(user_id)}'
+
+
+def cache_timeout():
+    return getattr(settings, 'USER_AUTH_CACHE_TIMEOUT', 60)
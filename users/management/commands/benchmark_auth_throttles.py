@@ -0,0 +1,75 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from shop.benchmarking import benchmark_database, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure what the token-bucket throttles add to POST /api/token/ next to the password hash it guards, '
+        'and what a throttled request costs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Timed logins per mode')
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        hashed = make_password('bench-password')
+        samples = []
+        for _ in range(max(requests // 10, 5)):
+            began = time.perf_counter()
+            check_password('bench-password', hashed)
+            samples.append(time.perf_counter() - began)
+        report = {'password_hash': summarize(samples)}
+
+        def rates(rate):
+            names = ('token_ip', 'token_username')
+            return {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {name: rate for name in names if rate}}
+
+        with benchmark_database():
+            User.objects.create_user(username='bench-login', password='bench-password')
+            # Logins are timed with a cheap hasher so that the throttle cost is not lost in the noise
+            with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+                User.objects.filter(username='bench-login').update(password=make_password('bench-password'))
+                for mode, rate in (('without_throttles', None), ('with_throttles', f'{requests * 100}/s')):
+                    with override_settings(REST_FRAMEWORK=rates(rate)):
+                        report[mode] = self.run(APIClient(), requests, 200)
+            # Each rejection would otherwise log a "Too Many Requests" warning
+            logging.getLogger('django.request').setLevel(logging.ERROR)
+            with override_settings(REST_FRAMEWORK=rates('1/d')):
+                client = APIClient()
+                client.post('/api/token/', {'username': 'bench-login', 'password': 'bench-password'}, format='json')
+                report['throttled'] = self.run(client, requests, 429)
+
+        base, throttled = report['without_throttles'], report['with_throttles']
+        report['overhead'] = {
+            key: round(throttled[key] - base[key], 3) for key in ('p50_ms', 'p95_ms', 'p99_ms')
+        }
+        report['overhead']['mean_us_per_request'] = round(
+            (throttled['seconds'] - base['seconds']) / throttled['count'] * 1e6, 1
+        )
+        report['overhead']['share_of_password_hash'] = round(
+            report['overhead']['p50_ms'] / report['password_hash']['p50_ms'], 4
+        )
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def run(client, requests, expected_status):
+        data = {'username': 'bench-login', 'password': 'bench-password'}
+        samples = []
+        start = time.perf_counter()
+        for _ in range(requests):
+            began = time.perf_counter()
+            response = client.post('/api/token/', data, format='json')
+            samples.append(time.perf_counter() - began)
+            assert response.status_code == expected_status, response.status_code
+        return {**summarize(samples), 'seconds': round(time.perf_counter() - start, 3)}
@@ -1,8 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+from .cache import invalidate_cached_user
+
 # Create your models here.
 
 class UserProfile(models.Model):
@@ -14,6 +16,23 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._saved_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    def has_changes(self):
+        """Whether any field differs from what was last loaded or saved."""
+        saved = getattr(self, '_saved_values', None)
+        if self._state.adding or saved is None:
+            return True
+        return any(getattr(self, name) != value for name, value in saved.items())
+
 class Address(models.Model):
     ADDRESS_TYPE_CHOICES = (
         ('home', 'Home'),
@@ -35,6 +54,9 @@ class Address(models.Model):
     class Meta:
         verbose_name_plural = 'Addresses'
         ordering = ['-is_default', '-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_default'], name='address_user_default_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s {self.get_address_type_display()} Address"
@@ -48,12 +70,22 @@ class Address(models.Model):
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        # Check if profile already exists
-        if not hasattr(instance, 'profile'):
+        # Check if profile already exists (a brand new user can only have one attached in memory)
+        if 'profile' not in instance._state.fields_cache:
             UserProfile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
-    # Only save if profile exists
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
+    # Only save a profile that is already loaded and was actually modified
+    profile = instance._state.fields_cache.get('profile')
+    if profile is not None and profile.has_changes():
+        profile.save()
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_profile_user_cache(sender, instance, **kwargs):
+    invalidate_cached_user(instance.user_id)
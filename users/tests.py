@@ -1,3 +1,195 @@
-from django.test import TestCase
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CachedJWTAuthentication, StatelessReadJWTAuthentication
+from .models import Address, UserProfile
+from .throttling import REDIS_CONSUME, TokenBucketThrottle, check_throttle_cache
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401 (fakeredis runs Lua scripts through it)
+except ImportError:
+    fakeredis = None
+
+# Real password hashing takes about as long as METRICS_SLOW_REQUEST_SECONDS
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(
+    REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'token_ip': '100/min', 'token_username': '2/min'}},
+    PASSWORD_HASHERS=FAST_HASHERS,
+)
+class PasswordThrottleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='buyer', password='secret-pass')
+
+    def login(self, username='buyer'):
+        return self.client.post('/api/token/', {'username': username, 'password': 'wrong'}, format='json')
+
+    def test_throttled_before_password_check(self):
+        with mock.patch.object(User, 'check_password', return_value=False) as check_password:
+            self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+            response = self.login(username='Buyer ')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(check_password.call_count, 2)
+        self.assertIn('Retry-After', response)
+
+    def test_bucket_refills_over_time(self):
+        clock = [1000.0]
+        with mock.patch.object(TokenBucketThrottle, 'timer', lambda self: clock[0]):
+            self.login()
+            self.login()
+            self.assertEqual(self.login().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            clock[0] += 30
+            self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(self.login().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class RedisTokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = RedisCache('redis://localhost:6379/0', {'KEY_PREFIX': 'test'})
+        self.clock = [1000.0]
+
+    def throttle(self, client):
+        throttle = TokenBucketThrottle()
+        throttle.cache = self.cache
+        throttle.timer = lambda: self.clock[0]
+        patcher = mock.patch.object(type(self.cache._cache), 'get_client', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return throttle
+
+    def test_script_result_sets_wait(self):
+        client = mock.Mock()
+        client.eval.return_value = [0, b'0.25']
+        throttle = self.throttle(client)
+        self.assertFalse(throttle.consume('bucket', 2, 2 / 60))
+        self.assertAlmostEqual(throttle.wait(), 22.5)
+        client.eval.assert_called_once_with(REDIS_CONSUME, 1, self.cache.make_and_validate_key('bucket'), 2, 2 / 60, 1000.0)
+
+    @skipUnless(fakeredis, 'needs fakeredis with Lua support (fakeredis[lua])')
+    def test_script_refills_and_drains_the_bucket(self):
+        server = fakeredis.FakeRedis()
+        throttle = self.throttle(server)
+        self.assertEqual([throttle.consume('bucket', 2, 2 / 60) for _ in range(3)], [True, True, False])
+        self.assertEqual(throttle.wait(), 30)
+        self.clock[0] += 30
+        self.assertTrue(throttle.consume('bucket', 2, 2 / 60))
+        self.assertIsNone(throttle.wait())
+        self.assertFalse(throttle.consume('bucket', 2, 2 / 60))
+        self.assertEqual(throttle.wait(), 30)
+        # The bucket expires once it would have refilled completely
+        self.assertEqual(server.ttl(self.cache.make_and_validate_key('bucket')), 61)
+
+    def test_deploy_check_warns_about_per_process_buckets(self):
+        self.assertEqual([warning.id for warning in check_throttle_cache(None)], ['users.W001'])
+        redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/0'}
+        with override_settings(CACHES={'default': redis}):
+            self.assertEqual(check_throttle_cache(None), [])
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class UserBulkImportTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='secret-pass'))
+
+    def upload(self, name, content, **data):
+        return self.client.post(
+            '/api/users/bulk-import/', {'file': SimpleUploadedFile(name, content.encode()), **data}, format='multipart'
+        )
+
+    def test_bad_rows_are_reported_by_line(self):
+        response = self.upload('users.jsonl', '\n'.join([
+            '{"username": "ann", "password": "secret-pass", "addresses": [{"street_address": "1 Main St", '
+            '"city": "Springfield", "state": "State", "country": "Country", "postal_code": "10001"}]}',
+            '{not json',
+            '{"username": ""}',
+            '{"username": "ann"}',
+            '{"username": "admin"}',
+        ]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['skipped']), (1, 1))
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 3, 4])
+        self.assertTrue(User.objects.get(username='ann').check_password('secret-pass'))
+        self.assertEqual(Address.objects.get(user__username='ann').city, 'Springfield')
+
+    def test_csv_address_columns(self):
+        response = self.upload('users.csv', (
+            'username,email,address_street_address,address_city,address_state,address_country,address_postal_code\n'
+            'bob,bob@example.com,2 Elm St,Shelbyville,State,Country,10002\n'
+        ))
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(Address.objects.get(user__username='bob').street_address, '2 Elm St')
+
+    def test_rejects_missing_file_and_unknown_format(self):
+        self.assertEqual(
+            self.client.post('/api/users/bulk-import/', {}, format='multipart').data, {'error': 'file is required'}
+        )
+        response = self.upload('users.xml', '<users/>')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserProfileSaveTests(APITestCase):
+    def test_profile_is_saved_only_when_changed(self):
+        user = User.objects.create_user(username='buyer', password='secret-pass')
+        user = User.objects.select_related('profile').get(pk=user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertFalse(any('users_userprofile' in query['sql'] for query in queries))
+
+        user.profile.phone_number = '555-0100'
+        user.save()
+        self.assertEqual(UserProfile.objects.get(user=user).phone_number, '555-0100')
+
+
+class CachedAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='secret-pass')
+        self.token = AccessToken.for_user(self.user)
+
+    def authenticate(self, authentication, method='get'):
+        request = getattr(RequestFactory(), method)('/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        return authentication.authenticate(request)[0]
+
+    def test_password_change_and_deactivation_invalidate_the_cached_user(self):
+        authentication = CachedJWTAuthentication()
+        self.authenticate(authentication)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.authenticate(authentication).check_password('secret-pass'))
+
+        self.user.set_password('new-secret-pass')
+        self.user.save()
+        self.assertTrue(self.authenticate(authentication).check_password('new-secret-pass'))
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(authentication)
+
+    def test_stateless_reads_only_for_safe_methods(self):
+        authentication = StatelessReadJWTAuthentication()
+        with self.assertNumQueries(0):
+            user = self.authenticate(authentication, 'get')
+        self.assertIsInstance(user, TokenUser)
+        self.assertEqual(user.id, self.user.pk)
+        self.assertIsInstance(self.authenticate(authentication, 'post'), User)
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(authentication, 'post')
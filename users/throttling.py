@@ -0,0 +1,133 @@
+"""Token-bucket throttles for the endpoints that hash passwords.
+
+DRF runs throttles before the handler, so a throttled request is rejected
+before any password hashing. Buckets live in the cache named by
+AUTH_THROTTLE_CACHE, which must be a RedisCache (set REDIS_URL) for limits to
+hold across worker processes: there each bucket is refilled and drawn from in
+one atomic server-side script. Any other backend is only updated atomically
+within the current process, which suits LocMemCache in development and tests;
+`manage.py check --deploy` warns about it (users.W001).
+
+Rates use DRF's "<capacity>/<period>" notation and are looked up in
+DEFAULT_THROTTLE_RATES as "<throttle_scope>_<kind>", e.g. "token_ip": "20/min"
+is a bucket of 20 requests per client IP refilled evenly over a minute. A
+scope without a rate is not throttled.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+# KEYS[1] = bucket, ARGV = capacity, tokens per second, now; returns {allowed, tokens left}
+REDIS_CONSUME = """
+local capacity, per_second, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * per_second)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.floor((capacity - tokens) / per_second) + 1)
+return {allowed, tostring(tokens)}
+"""
+_local_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """"20/min" -> (capacity 20, refill of 20/60 tokens per second)."""
+    count, period = rate.split('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    kind = None
+    timer = time.time
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'AUTH_THROTTLE_CACHE', 'default')]
+        self.wait_seconds = None
+
+    def get_ident_value(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}_{self.kind}') if scope else None
+        ident = self.get_ident_value(request) if rate else None
+        if not ident:
+            return True
+        digest = hashlib.md5(str(ident).encode()).hexdigest()
+        return self.consume(f'throttle:{scope}:{self.kind}:{digest}', *parse_rate(rate))
+
+    def consume(self, key, capacity, per_second):
+        """Take one token from the bucket at key; False if it is empty."""
+        now = self.timer()
+        if isinstance(self.cache, RedisCache):
+            allowed, tokens = self.consume_redis(key, capacity, per_second, now)
+        else:
+            allowed, tokens = self.consume_local(key, capacity, per_second, now)
+        self.wait_seconds = None if allowed else (1 - tokens) / per_second
+        return allowed
+
+    def consume_redis(self, key, capacity, per_second, now):
+        key = self.cache.make_and_validate_key(key)
+        client = self.cache._cache.get_client(key, write=True)
+        allowed, tokens = client.eval(REDIS_CONSUME, 1, key, capacity, per_second, now)
+        return bool(allowed), float(tokens)
+
+    def consume_local(self, key, capacity, per_second, now):
+        # A lock in this process is all the atomicity a per-process cache can offer
+        with _local_lock:
+            tokens, updated = self.cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(now - updated, 0) * per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # The entry may expire once the bucket would have refilled completely
+            self.cache.set(key, (tokens, now), int((capacity - tokens) / per_second) + 1)
+        return allowed, tokens
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'ip'
+
+    def get_ident_value(self, request):
+        return self.get_ident(request)
+
+
+class UsernameTokenBucketThrottle(TokenBucketThrottle):
+    """Keyed by the authenticated user, or else by the username being submitted."""
+    kind = 'username'
+
+    def get_ident_value(self, request):
+        if request.user and request.user.is_authenticated:
+            return request.user.get_username().lower()
+        username = request.data.get('username')
+        return username.strip().lower() if isinstance(username, str) else None
+
+
+def check_throttle_cache(app_configs, **kwargs):
+    """Deployment check: each worker process would keep its own buckets outside of Redis."""
+    alias = getattr(settings, 'AUTH_THROTTLE_CACHE', 'default')
+    if isinstance(caches[alias], RedisCache):
+        return []
+    return [checks.Warning(
+        f'AUTH_THROTTLE_CACHE {alias!r} is not a RedisCache, so every worker process enforces its own limits.',
+        hint='Set REDIS_URL, or point AUTH_THROTTLE_CACHE at a RedisCache alias.',
+        id='users.W001',
+    )]
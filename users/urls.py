@@ -2,6 +2,7 @@ from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .views import (
     UserRegistrationView,
+    UserBulkImportView,
     UserProfileView,
     ChangePasswordView,
     AddressListView,
@@ -11,6 +12,7 @@ from .views import (
 
 urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='register'),
+    path('bulk-import/', UserBulkImportView.as_view(), name='user-bulk-import'),
     path('profile/', UserProfileView.as_view(), name='profile'),
     path('change-password/', ChangePasswordView.as_view(), name='change-password'),
     path('addresses/', AddressListView.as_view(), name='address-list'),
@@ -1,17 +1,31 @@
 from django.shortcuts import render
 from rest_framework import generics, permissions, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from django.contrib.auth.models import User
 from .serializers import UserSerializer, UserProfileSerializer, AddressSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import Address
+from .importing import import_users, read_rows
+from core.importing import open_upload
+from .throttling import IPTokenBucketThrottle, UsernameTokenBucketThrottle
 
 # Create your views here.
 
+# Views that hash a password are throttled before the hash runs
+PASSWORD_THROTTLES = [IPTokenBucketThrottle, UsernameTokenBucketThrottle]
+
+class ThrottledTokenObtainPairView(TokenObtainPairView):
+    throttle_classes = PASSWORD_THROTTLES
+    throttle_scope = 'token'
+
 class UserRegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = PASSWORD_THROTTLES
+    throttle_scope = 'register'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -25,6 +39,18 @@ class UserRegistrationView(generics.CreateAPIView):
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class UserBulkImportView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            stream, fmt = open_upload(request)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        result = import_users(read_rows(stream, fmt))
+        return Response(result, status=status.HTTP_200_OK)
+
 class UserProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -34,6 +60,8 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
 
 class ChangePasswordView(generics.UpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = PASSWORD_THROTTLES
+    throttle_scope = 'change_password'
 
     def update(self, request, *args, **kwargs):
         user = request.user